@@ -0,0 +1,350 @@
+"""
+In-process benchmark of the update pipeline.
+
+Feeds synthetic updates into the real Dispatcher from main.py (same
+middlewares and routers) with a fake Bot session, so nothing goes to the
+network. The SQLite DB is a throwaway file seeded with --users rows.
+
+Usage:
+    python benchmark.py --users 100000 --iterations 2000
+    python benchmark.py --users 1000 --compare bench_results/previous.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Union, get_args, get_origin
+
+ADMIN_ID = 999999999
+
+# Must be set before config is imported
+DB_DIR = tempfile.mkdtemp(prefix="replyer-bench-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_DIR}/bench.db"
+os.environ["BOT_TOKEN"] = "123456:BENCHMARK"
+os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+os.environ["REDIS_URL"] = ""
+os.environ["USE_WEBHOOK"] = "False"
+# The fake API has no flood limits, measure our code rather than the pacing
+os.environ["SEND_RATE_GLOBAL"] = "1000000"
+os.environ["SEND_RATE_PER_CHAT"] = "1000000"
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, MessageId
+
+import main
+from database.db import init_db, warm_stats, AsyncSessionLocal
+from utils.registration import registration
+from utils.tasks import delayed_actions
+from utils.metrics import HandlerMetricsMiddleware
+
+
+# --- Fake Bot API ---
+
+class FakeSession(BaseSession):
+    """Answers every Bot API call locally with a minimal valid result."""
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._message_id = 0
+
+    def _message(self, bot: Bot, method) -> Message:
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None) or 1
+        return Message.model_validate({
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": getattr(method, "text", None),
+        }, context={"bot": bot})
+
+    def _result(self, bot: Bot, method, returning):
+        if get_origin(returning) is Union:
+            args = get_args(returning)
+            return True if bool in args else self._result(bot, method, args[0])
+        if get_origin(returning) is list:
+            return [self._result(bot, method, get_args(returning)[0])]
+        if returning is bool:
+            return True
+        if returning is MessageId:
+            self._message_id += 1
+            return MessageId(message_id=self._message_id)
+        if returning is Message:
+            return self._message(bot, method)
+        return None
+
+    async def make_request(self, bot: Bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        return self._result(bot, method, method.__returning__)
+
+    async def stream_content(self, *args, **kwargs):
+        # Downloads (e.g. /import documents) get an empty file
+        yield b""
+
+    async def close(self):
+        pass
+
+
+# --- Timing ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, name: str, seconds: float):
+        self.samples[name].append(seconds)
+
+    def report(self) -> dict:
+        report = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            total = sum(values)
+            report[name] = {
+                "count": len(values),
+                "per_sec": round(len(values) / total, 1) if total else None,
+                "p50_ms": round(values[len(values) // 2] * 1000, 3),
+                "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+                "mean_ms": round(statistics.fmean(values) * 1000, 3),
+            }
+        return report
+
+
+def time_middlewares(manager, recorder: Recorder):
+    """Wraps registered middlewares to record their own time (excluding what runs after them)."""
+    def timed(middleware):
+        # Unwrap the production metrics wrapper to report the real middleware
+        inner_middleware = getattr(middleware, "middleware", middleware)
+        name = f"middleware:{type(inner_middleware).__name__}"
+
+        async def wrapper(handler, event, data):
+            inner = 0.0
+
+            async def timed_handler(event, data):
+                nonlocal inner
+                started = time.perf_counter()
+                try:
+                    return await handler(event, data)
+                finally:
+                    inner += time.perf_counter() - started
+
+            started = time.perf_counter()
+            try:
+                return await middleware(timed_handler, event, data)
+            finally:
+                recorder.add(name, time.perf_counter() - started - inner)
+        return wrapper
+
+    manager._middlewares[:] = [
+        middleware if isinstance(middleware, HandlerMetricsMiddleware) else timed(middleware)
+        for middleware in manager._middlewares
+    ]
+
+
+def time_handlers(router, recorder: Recorder):
+    for observer in router.observers.values():
+        for handler in observer.handlers:
+            original = handler.callback
+            name = f"handler:{original.__name__}"
+
+            def make(original, name):
+                @wraps(original)
+                async def wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await original(*args, **kwargs)
+                    finally:
+                        recorder.add(name, time.perf_counter() - started)
+                return wrapper
+            handler.callback = make(original, name)
+
+
+# --- Synthetic data ---
+
+INSERT_USER = ("INSERT INTO users (user_id, first_name, username, joined_at, is_banned, mute_until) "
+               "VALUES (?, ?, ?, ?, ?, ?)")
+
+def seed_users(path: str, count: int):
+    """Bulk seeds users with the sync driver: ~1% banned, ~1% muted."""
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    rows = []
+    for user_id in range(1, count + 1):
+        banned = user_id % 100 == 0
+        muted = user_id % 100 == 50
+        rows.append((
+            user_id,
+            f"User {user_id}",
+            f"user{user_id}",
+            (now - timedelta(minutes=user_id % 20000)).isoformat(" "),
+            banned,
+            (now + timedelta(hours=1)).isoformat(" ") if muted else None,
+        ))
+        if len(rows) >= 50000:
+            conn.executemany(INSERT_USER, rows)
+            rows.clear()
+    if rows:
+        conn.executemany(INSERT_USER, rows)
+    conn.commit()
+    conn.close()
+
+
+class UpdateFactory:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.update_id = 0
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = self._next()
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }, context={"bot": self.bot})
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next()
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": "bench",
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                    "text": "menu",
+                },
+            },
+        }, context={"bot": self.bot})
+
+
+def scenarios(factory: UpdateFactory, users: int):
+    """name -> function(i) returning the i-th update of that scenario."""
+    active = [user_id for user_id in range(1, users + 1) if user_id % 100 not in (0, 50)]
+    deep_cursor = f"n{max(1, users - 20)}"
+    return {
+        "start_new_user": lambda i: factory.message(users + 1 + i, "/start"),
+        "feedback_text": lambda i: factory.message(active[i % len(active)], f"Hello #{i}"),
+        "throttled_user": lambda i: factory.message(active[0], f"Spam #{i}"),
+        "banned_user": lambda i: factory.message(100, "hi"),
+        "muted_user": lambda i: factory.message(50, "hi"),
+        "admin_stats": lambda i: factory.callback(ADMIN_ID, "admin_stats"),
+        "show_list_first_page": lambda i: factory.callback(ADMIN_ID, "list:users:1"),
+        "show_list_deep_page": lambda i: factory.callback(ADMIN_ID, f"list:users:{users // 10}:{deep_cursor}"),
+        "show_list_mutes": lambda i: factory.callback(ADMIN_ID, "list:mutes:1"),
+        "user_info": lambda i: factory.callback(ADMIN_ID, f"info:{active[i % len(active)]}"),
+        "find_user": lambda i: factory.message(ADMIN_ID, f"/find user{active[i % len(active)]}"),
+    }
+
+
+# --- Runner ---
+
+async def run(args) -> dict:
+    # Per-update INFO logs would dominate the measurements
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    await init_db()
+    seed_users(os.path.join(DB_DIR, "bench.db"), args.users)
+    async with AsyncSessionLocal() as session:
+        await warm_stats(session)
+
+    session = FakeSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    dp = main.dp
+
+    recorder = Recorder()
+    time_middlewares(dp.message.middleware, recorder)
+    time_handlers(main.admin.router, recorder)
+    time_handlers(main.user.router, recorder)
+
+    background = [
+        asyncio.create_task(registration.run()),
+        asyncio.create_task(delayed_actions.run()),
+    ]
+    factory = UpdateFactory(bot)
+    try:
+        for name, make_update in scenarios(factory, args.users).items():
+            if args.only and name not in args.only:
+                continue
+            updates = [make_update(i) for i in range(args.iterations)]
+            started = time.perf_counter()
+            for update in updates:
+                begin = time.perf_counter()
+                await dp.feed_update(bot, update)
+                recorder.add(f"scenario:{name}", time.perf_counter() - begin)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<24} {args.iterations / elapsed:>10.1f} updates/s", flush=True)
+    finally:
+        for task in background:
+            task.cancel()
+
+    return {
+        "date": datetime.utcnow().isoformat(timespec="seconds"),
+        "users": args.users,
+        "iterations": args.iterations,
+        "python": sys.version.split()[0],
+        "api_calls": dict(session.calls),
+        "results": recorder.report(),
+    }
+
+
+def print_report(report: dict, baseline: dict = None):
+    base = baseline["results"] if baseline else {}
+    print(f"\n{'name':<40} {'count':>7} {'per_sec':>10} {'p50_ms':>9} {'p99_ms':>9}" + ("  p50 vs base" if base else ""))
+    for name, row in report["results"].items():
+        line = f"{name:<40} {row['count']:>7} {row['per_sec'] or 0:>10} {row['p50_ms']:>9} {row['p99_ms']:>9}"
+        if name in base and base[name]["p50_ms"]:
+            change = (row["p50_ms"] - base[name]["p50_ms"]) / base[name]["p50_ms"] * 100
+            line += f"  {change:+.1f}%"
+        print(line)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark middlewares and handlers in-process")
+    parser.add_argument("--users", type=int, default=1000, help="seeded users (e.g. 1000, 100000, 1000000)")
+    parser.add_argument("--iterations", type=int, default=500, help="updates per scenario")
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--out", default=None, help="where to save JSON results (default bench_results/<users>-<date>.json)")
+    parser.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    out = args.out or os.path.join("bench_results", f"{args.users}-{report['date'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved to {out}")
+
+
+if __name__ == "__main__":
+    main_cli()
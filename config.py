@@ -18,6 +18,57 @@ USE_WEBHOOK = os.getenv("USE_WEBHOOK", "False").lower() == "true"
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
 WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
 WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 3000))
+# Prometheus /metrics: on the webhook app, or a separate server in polling mode
+# (0 = off). It has no authentication, so it listens on localhost by default.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Update ingestion (webhook and polling): bounded queue + worker pool
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 8))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 1000))
+INGEST_MAX_AGE = float(os.getenv("INGEST_MAX_AGE", 60))  # seconds, older updates are dropped
+# Admin updates get their own lane and INGEST_ADMIN_WORKERS extra workers.
+# Latency objectives (seconds from receipt to processed) per lane, see replyer_lane_slo_total
+INGEST_ADMIN_WORKERS = int(os.getenv("INGEST_ADMIN_WORKERS", 2))
+INGEST_ADMIN_QUEUE_SIZE = int(os.getenv("INGEST_ADMIN_QUEUE_SIZE", 100))
+INGEST_ADMIN_SLO = float(os.getenv("INGEST_ADMIN_SLO", 1))
+INGEST_USER_SLO = float(os.getenv("INGEST_USER_SLO", 5))
+
+# Database
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot.db")
 
 # Redis (Optional)
 REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Throttling: one message per `limit` seconds on average, THROTTLE_BURST at once.
+# Two-tier mode decides locally first and asks Redis only when not sure.
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", 1))
+THROTTLE_TWO_TIER = os.getenv("THROTTLE_TWO_TIER", "True").lower() == "true"
+
+# Outbound delivery (Telegram limits: ~30 msg/s overall, ~1 msg/s per chat)
+SEND_RATE_GLOBAL = float(os.getenv("SEND_RATE_GLOBAL", 30))
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", 1))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", 8))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# Broadcasts: kept under SEND_RATE_GLOBAL so replies to users still go out,
+# progress is checkpointed every BROADCAST_CHUNK recipients
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", 50))
+
+# Conversation history: written in batches, rows older than this are deleted
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 180))
+# Reply routes of admin-side messages, replies to older ones fall back to the "📩 <id>" header
+ROUTE_RETENTION_DAYS = int(os.getenv("ROUTE_RETENTION_DAYS", 90))
+
+# Repeated feedback (same or nearly the same content within the window) is counted
+# on the original admin message instead of being sent again (0 = off).
+# Texts shorter than DEDUP_MIN_LENGTH are only collapsed for the same user.
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", 600))
+DEDUP_MIN_LENGTH = int(os.getenv("DEDUP_MIN_LENGTH", 20))
+
+# Digest mode (/digest on): while feedback comes at DIGEST_BUSY_RATE messages a minute
+# or more, it is combined into one message every DIGEST_INTERVAL seconds or DIGEST_MAX_ITEMS items
+DIGEST_INTERVAL = int(os.getenv("DIGEST_INTERVAL", 30))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", 20))
+DIGEST_BUSY_RATE = int(os.getenv("DIGEST_BUSY_RATE", 30))
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Tests never touch the bot's own database, config is read on first import
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
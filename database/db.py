@@ -1,60 +1,470 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
-from .models import Base, User
-from datetime import datetime
-
-DATABASE_URL = "sqlite+aiosqlite:///bot.db"
+from sqlalchemy import select, insert, update, delete, func, tuple_, event, text, table, column, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import Base, User, MessageRoute, Broadcast, FeedbackMessage, AdminSettings
+from .migrations import run_migrations
+from datetime import datetime, timedelta
+from utils.cache import (
+    BANNED_USERS, BLOCKED_USERS, MUTE_CACHE, MUTE_NOTIFIED, PROFILE_CACHE, set_mute, remember_route, get_cached_route
+)
+from utils.stats import stats, RECENT_WINDOW
+from utils.shared_state import bus
+from utils.metrics import timed_db
+from config import DATABASE_URL
 
 engine = create_async_engine(DATABASE_URL, echo=False)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Production settings for SQLite: WAL lets readers run alongside the writer,
+# NORMAL sync is safe with WAL, busy_timeout waits for locks instead of failing.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # KiB, ~64 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # ms
+}
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
 
+@timed_db
 async def get_user(session: AsyncSession, user_id: int):
     result = await session.execute(select(User).where(User.user_id == user_id))
     return result.scalars().first()
 
-async def add_user(session: AsyncSession, user_id: int, first_name: str, username: str):
-    user = await get_user(session, user_id)
-    if not user:
-        user = User(user_id=user_id, first_name=first_name, username=username)
-        session.add(user)
-        await session.commit()
+@timed_db
+async def update_user(session: AsyncSession, user_id: int, **values):
+    """One UPDATE ... RETURNING: applies values and returns the updated user (None if unknown)."""
+    result = await session.execute(
+        update(User).where(User.user_id == user_id).values(**values).returning(User)
+    )
+    user = result.scalars().first()
+    await session.commit()
     return user
 
-async def get_all_users_count(session: AsyncSession):
-    result = await session.execute(select(User))
-    return len(result.scalars().all())
+@timed_db
+async def bulk_update_users(session: AsyncSession, user_ids: list, values: dict, chunk_size: int = 500):
+    """
+    Set-based moderation: one UPDATE ... WHERE user_id IN (chunk) RETURNING per
+    chunk, all in one transaction. Returns the ids that exist and were updated.
+    """
+    updated = []
+    for i in range(0, len(user_ids), chunk_size):
+        result = await session.execute(
+            update(User)
+            .where(User.user_id.in_(user_ids[i:i + chunk_size]))
+            .values(**values)
+            .returning(User.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        updated.extend(result.scalars().all())
+    await session.commit()
+    return updated
 
-async def get_banned_users_count(session: AsyncSession):
-    result = await session.execute(select(User).where(User.is_banned == True))
-    return len(result.scalars().all())
+# Import upsert: values missing in the file (NULL) keep what is stored
+IMPORT_UPSERT = text(
+    "INSERT INTO users (user_id, first_name, username, joined_at, is_banned, mute_until) "
+    "VALUES (:user_id, :first_name, :username, :joined_at, coalesce(:is_banned, 0), :mute_until) "
+    "ON CONFLICT(user_id) DO UPDATE SET "
+    "first_name = coalesce(:first_name, users.first_name), "
+    "username = coalesce(:username, users.username), "
+    "is_banned = coalesce(:is_banned, users.is_banned), "
+    "mute_until = coalesce(:mute_until, users.mute_until) "
+)
 
-async def get_muted_users_count(session: AsyncSession):
+@timed_db
+async def upsert_users(session: AsyncSession, rows: list):
+    """rows: [{"user_id", "first_name", "username", "joined_at", "is_banned", "mute_until"}, ...], one executemany"""
+    await session.execute(IMPORT_UPSERT, rows)
+    await session.commit()
+
+@timed_db
+async def add_users_bulk(session: AsyncSession, rows: list):
+    """
+    rows: [{"user_id", "first_name", "username", "joined_at"}, ...]
+    One INSERT ... ON CONFLICT DO NOTHING, returns ids that were actually new.
+    """
+    if not rows:
+        return []
+    stmt = (
+        sqlite_insert(User)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[User.user_id])
+        .returning(User.user_id, User.joined_at)
+    )
+    result = await session.execute(stmt)
+    inserted = result.all()
+    await session.commit()
+    for user_id, joined_at in inserted:
+        stats.user_added(joined_at)
+    if inserted:
+        # One message per batch, its rows joined within one flush interval
+        bus.publish_many("user", [user_id for user_id, _ in inserted], max(joined_at for _, joined_at in inserted))
+    return [user_id for user_id, _ in inserted]
+
+@timed_db
+async def warm_stats(session: AsyncSession):
+    """Loads ban/mute caches and moderation counters on startup (and after a pub/sub outage)."""
     now = datetime.utcnow()
-    result = await session.execute(select(User).where(User.mute_until > now))
-    return len(result.scalars().all())
+    total = await get_all_users_count(session)
 
-async def get_users_paginated(session: AsyncSession, page: int, limit: int = 10):
-    offset = (page - 1) * limit
-    result = await session.execute(select(User).offset(offset).limit(limit))
-    return result.scalars().all()
+    result = await session.execute(select(User.user_id).where(User.is_banned == True))
+    BANNED_USERS.clear()
+    BANNED_USERS.update(result.scalars().all())
 
-async def get_banned_paginated(session: AsyncSession, page: int, limit: int = 10):
-    offset = (page - 1) * limit
-    result = await session.execute(select(User).where(User.is_banned == True).offset(offset).limit(limit))
-    return result.scalars().all()
+    result = await session.execute(select(User.user_id).where(User.blocked_at.is_not(None)))
+    BLOCKED_USERS.clear()
+    BLOCKED_USERS.update(result.scalars().all())
+
+    result = await session.execute(select(User.user_id, User.mute_until).where(User.mute_until > now))
+    muted = {user_id: until for user_id, until in result.all()}
+    MUTE_CACHE.clear()
+    MUTE_NOTIFIED.clear()
+    PROFILE_CACHE.clear()
+    for user_id, until in muted.items():
+        set_mute(user_id, until)
+
+    result = await session.execute(select(User.joined_at).where(User.joined_at >= now - RECENT_WINDOW))
+    recent = [joined_at for joined_at in result.scalars().all() if joined_at]
+
+    stats.load(total, muted, recent)
+
+@timed_db
+async def get_all_users_count(session: AsyncSession):
+    result = await session.execute(select(func.count()).select_from(User))
+    return result.scalar_one()
+
+# --- Keyset pagination ---
+# Cursors are tuples of ints: (user_id,) for users/bans and
+# (mute_until in microseconds, user_id) for mutes. direction "n" fetches
+# rows after the cursor, "p" rows before it. Every page costs one index
+# range scan regardless of how deep it is.
 
-async def get_muted_paginated(session: AsyncSession, page: int, limit: int = 10):
-    offset = (page - 1) * limit
+EPOCH = datetime(1970, 1, 1)
+
+def user_cursor_key(user: User) -> tuple:
+    return (user.user_id,)
+
+def mute_cursor_key(user: User) -> tuple:
+    return ((user.mute_until - EPOCH) // timedelta(microseconds=1), user.user_id)
+
+async def _keyset_page(session: AsyncSession, stmt, columns: list, limit: int, cursor=None,
+                       descending: bool = False):
+    """Returns (items, has_more) where has_more is about the travel direction."""
+    direction, key = cursor if cursor else ("n", None)
+    # Walking the key upwards: "n" on ascending lists, "p" on descending ones
+    ascending = (direction == "n") != descending
+    key_expr = tuple_(*columns) if len(columns) > 1 else columns[0]
+    if key is not None:
+        key_value = tuple_(*key) if len(columns) > 1 else key[0]
+        stmt = stmt.where(key_expr > key_value if ascending else key_expr < key_value)
+
+    order = columns if ascending else [column.desc() for column in columns]
+    result = await session.execute(stmt.order_by(*order).limit(limit + 1))
+    items = list(result.scalars().all())
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == "p":
+        items.reverse()
+    return items, has_more
+
+@timed_db
+async def get_users_paginated(session: AsyncSession, limit: int = 10, cursor=None):
+    return await _keyset_page(session, select(User), [User.user_id], limit, cursor)
+
+# FTS5 trigram index over first_name/username, see migration 3
+users_fts = table("users_fts", column("rowid"))
+
+def _fts_match(query: str):
+    # Quoted as one phrase: a trigram phrase is a plain substring match
+    phrase = '"' + query.replace('"', '""') + '"'
+    return text("users_fts MATCH :query").bindparams(query=phrase)
+
+@timed_db
+async def search_users(session: AsyncSession, query: str, limit: int = 10, cursor=None):
+    """Substring search (3+ characters), paginated by user_id like the other lists."""
+    stmt = select(User).join(users_fts, users_fts.c.rowid == User.user_id).where(_fts_match(query))
+    # Keyset on the FTS rowid: the index walks it in order, no sort of all matches
+    return await _keyset_page(session, stmt, [users_fts.c.rowid], limit, cursor)
+
+@timed_db
+async def count_search_results(session: AsyncSession, query: str):
+    result = await session.execute(select(func.count()).select_from(users_fts).where(_fts_match(query)))
+    return result.scalar_one()
+
+@timed_db
+async def get_banned_paginated(session: AsyncSession, limit: int = 10, cursor=None):
+    stmt = select(User).where(User.is_banned == True)
+    return await _keyset_page(session, stmt, [User.user_id], limit, cursor)
+
+@timed_db
+async def get_muted_paginated(session: AsyncSession, limit: int = 10, cursor=None):
     now = datetime.utcnow()
-    result = await session.execute(select(User).where(User.mute_until > now).offset(offset).limit(limit))
-    return result.scalars().all()
+    if cursor:
+        direction, (micros, user_id) = cursor
+        cursor = (direction, (EPOCH + timedelta(microseconds=micros), user_id))
+    stmt = select(User).where(User.mute_until > now)
+    return await _keyset_page(session, stmt, [User.mute_until, User.user_id], limit, cursor)
 
+@timed_db
 async def get_new_users_period(session: AsyncSession, delta: timedelta):
     since = datetime.utcnow() - delta
-    result = await session.execute(select(User).where(User.joined_at >= since))
-    return len(result.scalars().all())
+    result = await session.execute(select(func.count()).select_from(User).where(User.joined_at >= since))
+    return result.scalar_one()
+
+# --- Reply routing ---
+
+@timed_db
+async def add_message_routes(session: AsyncSession, routes: list):
+    """routes: [(admin_chat_id, message_id, user_id), ...]"""
+    if not routes:
+        return
+    rows = [{"admin_chat_id": chat_id, "message_id": message_id, "user_id": user_id}
+            for chat_id, message_id, user_id in routes]
+    stmt = sqlite_insert(MessageRoute).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MessageRoute.admin_chat_id, MessageRoute.message_id],
+        set_={"user_id": stmt.excluded.user_id}
+    )
+    await session.execute(stmt)
+    await session.commit()
+    for chat_id, message_id, user_id in routes:
+        remember_route(chat_id, message_id, user_id)
+
+@timed_db
+async def get_routed_user(session: AsyncSession, admin_chat_id: int, message_id: int):
+    user_id = get_cached_route(admin_chat_id, message_id)
+    if user_id is not None:
+        return user_id
+    result = await session.execute(
+        select(MessageRoute.user_id).where(
+            MessageRoute.admin_chat_id == admin_chat_id,
+            MessageRoute.message_id == message_id
+        )
+    )
+    user_id = result.scalar_one_or_none()
+    if user_id is not None:
+        remember_route(admin_chat_id, message_id, user_id)
+    return user_id
+
+@timed_db
+async def prune_message_routes(session: AsyncSession, before: datetime, chunk_size: int = 5000):
+    """Deletes one chunk of routes older than `before`, returns how many were deleted."""
+    old_keys = (
+        select(MessageRoute.admin_chat_id, MessageRoute.message_id)
+        .where(MessageRoute.created_at < before)
+        .order_by(MessageRoute.created_at)
+        .limit(chunk_size)
+    )
+    result = await session.execute(
+        delete(MessageRoute).where(tuple_(MessageRoute.admin_chat_id, MessageRoute.message_id).in_(old_keys))
+    )
+    await session.commit()
+    return result.rowcount
+
+# --- Broadcasts ---
+
+def _recipients_query():
+    # Banned users and users who blocked the bot are skipped
+    return select(User.user_id).where(User.is_banned.is_not(True), User.blocked_at.is_(None))
+
+@timed_db
+async def count_broadcast_recipients(session: AsyncSession):
+    result = await session.execute(select(func.count()).select_from(_recipients_query().subquery()))
+    return result.scalar_one()
+
+async def iter_broadcast_recipients(after_user_id: int, chunk_size: int = 50, window: int = 10000):
+    """
+    Yields chunks of recipient ids in user_id order, starting after after_user_id.
+    Ids are read with a server-side cursor, one window at a time: memory stays
+    bounded and no read transaction is held open while messages are being sent.
+    """
+    while True:
+        ids = []
+        async with AsyncSessionLocal() as session:
+            result = await session.stream_scalars(
+                _recipients_query()
+                .where(User.user_id > after_user_id)
+                .order_by(User.user_id)
+                .limit(window)
+                .execution_options(yield_per=chunk_size)
+            )
+            async for partition in result.partitions():
+                ids.extend(partition)
+        for i in range(0, len(ids), chunk_size):
+            yield ids[i:i + chunk_size]
+        if len(ids) < window:
+            return
+        after_user_id = ids[-1]
+
+@timed_db
+async def create_broadcast(session: AsyncSession, admin_chat_id: int, progress_message_id: int,
+                           from_chat_id: int, message_id: int, total: int):
+    broadcast = Broadcast(
+        admin_chat_id=admin_chat_id,
+        progress_message_id=progress_message_id,
+        from_chat_id=from_chat_id,
+        message_id=message_id,
+        total=total,
+        status="running",
+        last_user_id=0,
+        sent=0,
+        failed=0,
+        blocked=0,
+    )
+    session.add(broadcast)
+    await session.commit()
+    return broadcast
+
+@timed_db
+async def claim_broadcast(session: AsyncSession, broadcast: Broadcast, owner: str, lease: timedelta) -> bool:
+    """Takes a running broadcast unless another instance holds a live lease on it."""
+    now = datetime.utcnow()
+    result = await session.execute(
+        update(Broadcast).where(
+            Broadcast.id == broadcast.id,
+            Broadcast.status == "running",
+            or_(Broadcast.lease_owner.is_(None), Broadcast.lease_owner == owner, Broadcast.lease_until < now),
+        ).values(lease_owner=owner, lease_until=now + lease)
+    )
+    await session.commit()
+    return bool(result.rowcount)
+
+@timed_db
+async def save_broadcast_progress(session: AsyncSession, broadcast: Broadcast, blocked_ids: list = (),
+                                  lease: timedelta = timedelta(minutes=5)) -> bool:
+    """
+    Checkpoint: counters, last handled user and who blocked the bot, in one
+    transaction. Renews the lease, returns False if another instance took it over.
+    A cancel from any instance is picked up here: broadcast.status becomes "cancelled".
+    """
+    if blocked_ids:
+        await session.execute(
+            update(User).where(User.user_id.in_(blocked_ids)).values(blocked_at=datetime.utcnow())
+        )
+    owned = (Broadcast.id == broadcast.id, Broadcast.lease_owner == broadcast.lease_owner)
+    values = dict(
+        last_user_id=broadcast.last_user_id,
+        sent=broadcast.sent,
+        failed=broadcast.failed,
+        blocked=broadcast.blocked,
+        lease_until=datetime.utcnow() + lease,
+    )
+    result = await session.execute(
+        update(Broadcast).where(*owned, Broadcast.status == "running").values(
+            status=broadcast.status, finished_at=broadcast.finished_at, **values
+        )
+    )
+    if not result.rowcount:
+        # Cancelled meanwhile: the counters are stored, the status is kept
+        result = await session.execute(
+            update(Broadcast).where(*owned, Broadcast.status == "cancelled").values(**values)
+        )
+        if not result.rowcount:
+            await session.rollback()
+            return False
+        broadcast.status = "cancelled"
+    await session.commit()
+    if blocked_ids:
+        BLOCKED_USERS.update(blocked_ids)
+        bus.publish_many("blocked", blocked_ids)
+    return True
+
+@timed_db
+async def cancel_broadcast(session: AsyncSession, broadcast_id: int) -> bool:
+    """False if it is not running. The instance sending it stops at its next checkpoint."""
+    result = await session.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+        .values(status="cancelled", finished_at=datetime.utcnow())
+    )
+    await session.commit()
+    return bool(result.rowcount)
+
+@timed_db
+async def clear_blocked(session: AsyncSession, user_id: int):
+    """The user wrote to the bot, so it is not blocked anymore: back in broadcasts."""
+    await session.execute(
+        update(User).where(User.user_id == user_id, User.blocked_at.is_not(None)).values(blocked_at=None)
+    )
+    await session.commit()
+    BLOCKED_USERS.discard(user_id)
+    bus.publish("unblocked", user_id)
+
+@timed_db
+async def get_broadcast(session: AsyncSession, broadcast_id: int):
+    return await session.get(Broadcast, broadcast_id)
+
+@timed_db
+async def get_running_broadcasts(session: AsyncSession):
+    result = await session.execute(select(Broadcast).where(Broadcast.status == "running").order_by(Broadcast.id))
+    return result.scalars().all()
+
+# --- Conversation history ---
+
+def history_cursor_key(entry: FeedbackMessage) -> tuple:
+    return ((entry.created_at - EPOCH) // timedelta(microseconds=1), entry.id)
+
+@timed_db
+async def add_feedback_messages(session: AsyncSession, rows: list):
+    """rows: [{"user_id", "direction", "admin_id", "content_type", "text", "created_at"}, ...]"""
+    if not rows:
+        return
+    await session.execute(insert(FeedbackMessage), rows)
+    await session.commit()
+
+@timed_db
+async def get_user_history(session: AsyncSession, user_id: int, limit: int = 10, cursor=None):
+    """Newest first, keyset on (created_at, id) along ix_feedback_user_created."""
+    if cursor:
+        direction, (micros, entry_id) = cursor
+        cursor = (direction, (EPOCH + timedelta(microseconds=micros), entry_id))
+    stmt = select(FeedbackMessage).where(FeedbackMessage.user_id == user_id)
+    return await _keyset_page(session, stmt, [FeedbackMessage.created_at, FeedbackMessage.id],
+                              limit, cursor, descending=True)
+
+@timed_db
+async def get_user_history_count(session: AsyncSession, user_id: int):
+    result = await session.execute(
+        select(func.count()).select_from(FeedbackMessage).where(FeedbackMessage.user_id == user_id)
+    )
+    return result.scalar_one()
+
+@timed_db
+async def prune_feedback_messages(session: AsyncSession, before: datetime, chunk_size: int = 5000):
+    """Deletes one chunk of messages older than `before`, returns how many were deleted."""
+    old_ids = (
+        select(FeedbackMessage.id)
+        .where(FeedbackMessage.created_at < before)
+        .order_by(FeedbackMessage.created_at)
+        .limit(chunk_size)
+    )
+    result = await session.execute(delete(FeedbackMessage).where(FeedbackMessage.id.in_(old_ids)))
+    await session.commit()
+    return result.rowcount
+
+# --- Admin settings ---
+
+@timed_db
+async def get_digest_admins(session: AsyncSession):
+    result = await session.execute(select(AdminSettings.admin_id).where(AdminSettings.digest.is_(True)))
+    return result.scalars().all()
+
+@timed_db
+async def set_digest(session: AsyncSession, admin_id: int, enabled: bool):
+    stmt = sqlite_insert(AdminSettings).values(admin_id=admin_id, digest=enabled)
+    stmt = stmt.on_conflict_do_update(index_elements=[AdminSettings.admin_id], set_={"digest": enabled})
+    await session.execute(stmt)
+    await session.commit()
@@ -0,0 +1,80 @@
+# Versioned schema migrations for existing databases.
+# create_all only creates missing tables, so anything added to an existing
+# table (indexes, columns) goes here. The applied version is kept in
+# SQLite's PRAGMA user_version. Never edit a released migration, add a new one.
+# A step is either SQL or an async callable taking the connection.
+
+def add_column(table: str, column: str, ddl: str):
+    # Fresh databases already have the column from create_all
+    async def step(conn):
+        result = await conn.exec_driver_sql(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in result.all()]:
+            await conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return step
+
+MIGRATIONS = [
+    (1, "moderation indexes", [
+        # Duplicate of the primary key index
+        "DROP INDEX IF EXISTS ix_users_user_id",
+        "CREATE INDEX IF NOT EXISTS ix_users_banned ON users (user_id) WHERE is_banned = 1",
+        "CREATE INDEX IF NOT EXISTS ix_users_mute_until ON users (mute_until, user_id) WHERE mute_until IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_users_joined_at ON users (joined_at)",
+    ]),
+    (2, "users who blocked the bot", [
+        add_column("users", "blocked_at", "DATETIME"),
+    ]),
+    # Substring search over names for /find. External content table on users,
+    # kept in sync by triggers so every insert path (registration, import) is covered.
+    (3, "user search index", [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "first_name, username, content='users', content_rowid='user_id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts(rowid, first_name, username) VALUES (new.user_id, new.first_name, new.username); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, first_name, username) "
+        "VALUES ('delete', old.user_id, old.first_name, old.username); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF first_name, username ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, first_name, username) "
+        "VALUES ('delete', old.user_id, old.first_name, old.username); "
+        "INSERT INTO users_fts(rowid, first_name, username) VALUES (new.user_id, new.first_name, new.username); "
+        "END",
+        "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+    ]),
+    # Upserts (imports) list the name columns in SET even when nothing changed
+    (4, "reindex names only when they change", [
+        "DROP TRIGGER IF EXISTS users_fts_update",
+        "CREATE TRIGGER users_fts_update AFTER UPDATE OF first_name, username ON users "
+        "WHEN old.first_name IS NOT new.first_name OR old.username IS NOT new.username BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, first_name, username) "
+        "VALUES ('delete', old.user_id, old.first_name, old.username); "
+        "INSERT INTO users_fts(rowid, first_name, username) VALUES (new.user_id, new.first_name, new.username); "
+        "END",
+    ]),
+    (5, "broadcast leases", [
+        add_column("broadcasts", "lease_owner", "VARCHAR"),
+        add_column("broadcasts", "lease_until", "DATETIME"),
+    ]),
+    (6, "reply route retention", [
+        "CREATE INDEX IF NOT EXISTS ix_message_routes_created_at ON message_routes (created_at)",
+    ]),
+]
+
+async def get_schema_version(conn) -> int:
+    result = await conn.exec_driver_sql("PRAGMA user_version")
+    return result.scalar()
+
+async def run_migrations(conn):
+    """Applies pending migrations inside the caller's transaction."""
+    version = await get_schema_version(conn)
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        for statement in statements:
+            if callable(statement):
+                await statement(conn)
+            else:
+                await conn.exec_driver_sql(statement)
+        await conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+        print(f"✅ DB migrated to v{number}: {description}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, BigInteger, Index, text
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 
@@ -7,12 +7,96 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = 'users'
 
-    user_id = Column(BigInteger, primary_key=True, index=True)
+    user_id = Column(BigInteger, primary_key=True)
     first_name = Column(String, nullable=True)
     username = Column(String, nullable=True)
     joined_at = Column(DateTime, default=datetime.utcnow)
     is_banned = Column(Boolean, default=False)
     mute_until = Column(DateTime, nullable=True)
+    # Set when a broadcast finds the user blocked the bot (cleanup candidates)
+    blocked_at = Column(DateTime, nullable=True)
+
+    # Existing databases get these through database/migrations.py
+    __table_args__ = (
+        # Ban list / ban cache warmup, only banned rows are indexed
+        Index("ix_users_banned", "user_id", sqlite_where=text("is_banned = 1")),
+        # Mute list (keyset on mute_until, user_id) and mute expiry
+        Index("ix_users_mute_until", "mute_until", "user_id", sqlite_where=text("mute_until IS NOT NULL")),
+        # "New in 24h / 7d"
+        Index("ix_users_joined_at", "joined_at"),
+    )
 
     def __repr__(self):
         return f"<User(id={self.user_id}, username={self.username})>"
+
+class MessageRoute(Base):
+    # Which user an admin-side message belongs to, for reply routing
+    __tablename__ = 'message_routes'
+    __table_args__ = (
+        # Retention deletes the oldest rows first
+        Index("ix_message_routes_created_at", "created_at"),
+    )
+
+    admin_chat_id = Column(BigInteger, primary_key=True)
+    message_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<MessageRoute({self.admin_chat_id}:{self.message_id} -> {self.user_id})>"
+
+class Broadcast(Base):
+    # Message sent to every user, progress is checkpointed so restarts resume
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True)
+    admin_chat_id = Column(BigInteger, nullable=False)
+    progress_message_id = Column(BigInteger, nullable=True)
+    from_chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    status = Column(String, default="running")  # running / done / cancelled
+    last_user_id = Column(BigInteger, default=0)  # everyone up to this id was handled
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    # Instance running it, renewed on every checkpoint so only one instance resumes it
+    lease_owner = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status={self.status}, last_user_id={self.last_user_id})>"
+
+class FeedbackMessage(Base):
+    # Append-only conversation log: what users sent and what admins answered
+    __tablename__ = 'feedback_messages'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    direction = Column(String, nullable=False)  # "in" from the user, "out" an admin reply
+    admin_id = Column(BigInteger, nullable=True)
+    content_type = Column(String, nullable=False)
+    text = Column(Text, nullable=True)  # text or caption, truncated
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Per-user history, newest first
+        Index("ix_feedback_user_created", "user_id", "created_at"),
+        # Retention deletes
+        Index("ix_feedback_created_at", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<FeedbackMessage(user_id={self.user_id}, direction={self.direction})>"
+
+class AdminSettings(Base):
+    # Per-admin delivery preferences
+    __tablename__ = 'admin_settings'
+
+    admin_id = Column(BigInteger, primary_key=True)
+    digest = Column(Boolean, default=False)  # combine feedback into digests under high volume
+
+    def __repr__(self):
+        return f"<AdminSettings(admin_id={self.admin_id}, digest={self.digest})>"
@@ -1,23 +1,35 @@
 import re
 from datetime import datetime, timedelta
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy import select
 
 from database.db import (
-    AsyncSessionLocal, User, get_user, 
-    get_all_users_count, get_banned_users_count, get_muted_users_count,
+    AsyncSessionLocal, User, get_user, update_user, bulk_update_users,
     get_users_paginated, get_banned_paginated, get_muted_paginated,
-    get_new_users_period
+    user_cursor_key, mute_cursor_key, get_routed_user,
+    count_broadcast_recipients, create_broadcast, search_users, count_search_results,
+    get_user_history, get_user_history_count, history_cursor_key
 )
 from utils.admin_utils import IsAdmin
 from utils.time_utils import format_dt
-from utils.cache import add_ban, remove_ban
-from keyboards.admin_kb import get_action_keyboard, main_admin_kb
-from keyboards.pagination import create_pagination_keyboard
+from utils.cache import (
+    add_ban, remove_ban, add_bans, remove_bans, set_mute, clear_mute, remember_search, get_search, get_profile_card, set_profile_card
+)
+from utils.stats import stats
+from utils.tasks import mute_scheduler
+from utils.delivery import delivery
+from utils.shared_state import bus
+from utils.broadcast import broadcaster
+from utils.history import history
+from utils.export import exporter, FORMATS
+from utils.importer import importer
+from utils.digest import digests, header_user, HEADER
+from keyboards.admin_kb import get_action_keyboard, main_admin_kb, broadcast_confirm_kb, broadcast_progress_kb
+from keyboards.pagination import create_pagination_keyboard, encode_cursor, decode_cursor
 
 router = Router()
 router.message.filter(IsAdmin())
@@ -25,6 +37,7 @@ router.callback_query.filter(IsAdmin())
 
 class AdminStates(StatesGroup):
     waiting_for_mute_time = State()
+    waiting_for_broadcast = State()
 
 @router.message(Command("admin"))
 async def admin_panel(message: Message):
@@ -37,12 +50,12 @@ async def admin_home_cb(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        total = await get_all_users_count(session)
-        banned = await get_banned_users_count(session)
-        muted = await get_muted_users_count(session)
-        new24h = await get_new_users_period(session, timedelta(hours=24))
-        new7d = await get_new_users_period(session, timedelta(days=7))
+    # Counters are kept in memory, no DB round trip here
+    total = stats.total_users
+    banned = stats.banned_count
+    muted = stats.muted_count
+    new24h = stats.new_users_since(timedelta(hours=24))
+    new7d = stats.new_users_since(timedelta(days=7))
     
     text = (
         f"📊 **Подробная Статистика**\n\n"
@@ -58,24 +71,28 @@ async def admin_stats(callback: CallbackQuery):
 # --- LISTS HANDLERS ---
 @router.callback_query(F.data.startswith("list:"))
 async def show_list(callback: CallbackQuery):
-    # data: list:type:page
+    # data: list:type:page[:cursor]
     parts = callback.data.split(":")
     list_type = parts[1]
     page = int(parts[2])
+    cursor = decode_cursor(parts[3]) if len(parts) > 3 else None
     limit = 10
     
     async with AsyncSessionLocal() as session:
         if list_type == "users":
-            items = await get_users_paginated(session, page, limit)
-            total = await get_all_users_count(session)
+            items, has_more = await get_users_paginated(session, limit, cursor)
+            total = stats.total_users
+            cursor_key = user_cursor_key
             label = "Пользователи"
         elif list_type == "bans":
-            items = await get_banned_paginated(session, page, limit)
-            total = await get_banned_users_count(session)
+            items, has_more = await get_banned_paginated(session, limit, cursor)
+            total = stats.banned_count
+            cursor_key = user_cursor_key
             label = "Бан-лист"
         elif list_type == "mutes":
-            items = await get_muted_paginated(session, page, limit)
-            total = await get_muted_users_count(session)
+            items, has_more = await get_muted_paginated(session, limit, cursor)
+            total = stats.muted_count
+            cursor_key = mute_cursor_key
             label = "Мут-лист"
         else:
             return await callback.answer("Error")
@@ -89,6 +106,11 @@ async def show_list(callback: CallbackQuery):
         if total == 0:
              await callback.message.edit_text(f"📂 **{label}**: Список пуст", reply_markup=main_admin_kb(), parse_mode="Markdown")
              return
+
+    # Going back always has a next page; going forward only if the DB said so
+    has_next = has_more if not cursor or cursor[0] == "n" else True
+    prev_cursor = encode_cursor("p", cursor_key(items[0])) if items else None
+    next_cursor = encode_cursor("n", cursor_key(items[-1])) if items and has_next else None
             
     text = f"📂 **{label}** (Стр. {page})"
     kb = create_pagination_keyboard(
@@ -98,11 +120,75 @@ async def show_list(callback: CallbackQuery):
         items_per_page=limit,
         callback_prefix=f"list:{list_type}",
         item_key="user_id",
-        item_label="first_name"
+        item_label="first_name",
+        keyset=True,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
         
     await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
 
+# --- SEARCH ---
+@router.message(Command("find"))
+async def find_cmd(message: Message, command: CommandObject):
+    # Usage: /find <part of name or username>
+    query = (command.args or "").strip().lstrip("@")
+    if query.isdigit():
+        return await show_user_info(message, int(query))
+    if len(query) < 3:
+        return await message.answer("Использование: /find <имя или username> (минимум 3 символа)")
+
+    async with AsyncSessionLocal() as session:
+        total = await count_search_results(session, query)
+    token = remember_search(query, total)
+    await show_search_page(message, token, 1)
+
+@router.callback_query(F.data.startswith("find:"))
+async def find_cb(callback: CallbackQuery):
+    # data: find:token:page[:cursor]
+    parts = callback.data.split(":")
+    page = int(parts[2])
+    cursor = decode_cursor(parts[3]) if len(parts) > 3 else None
+    await show_search_page(callback.message, parts[1], page, cursor, is_edit=True)
+
+async def show_search_page(event: Message, token: str, page: int, cursor=None, is_edit: bool = False):
+    search = get_search(token)
+    if not search:
+        return await event.answer("Поиск устарел, повторите /find.")
+    query, total = search
+    limit = 10
+
+    async with AsyncSessionLocal() as session:
+        items, has_more = await search_users(session, query, limit, cursor)
+
+    if not items and page == 1:
+        text = f"🔍 По запросу «{query}» ничего не найдено."
+        if is_edit: await event.edit_text(text, reply_markup=main_admin_kb())
+        else: await event.answer(text)
+        return
+
+    has_next = has_more if not cursor or cursor[0] == "n" else True
+    prev_cursor = encode_cursor("p", user_cursor_key(items[0])) if items else None
+    next_cursor = encode_cursor("n", user_cursor_key(items[-1])) if items and has_next else None
+
+    text = f"🔍 «{query}»: найдено {total} (Стр. {page})"
+    kb = create_pagination_keyboard(
+        items=items,
+        page=page,
+        total_count=total,
+        items_per_page=limit,
+        callback_prefix=f"find:{token}",
+        item_key="user_id",
+        item_label="first_name",
+        keyset=True,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
+    )
+    if is_edit:
+        await event.edit_text(text, reply_markup=kb)
+    else:
+        await event.answer(text, reply_markup=kb)
+
 @router.callback_query(F.data == "noop")
 async def noop_cb(callback: CallbackQuery):
     await callback.answer()
@@ -127,36 +213,86 @@ async def user_info_cb(callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
     await show_user_info(callback.message, user_id, is_edit=True)
 
-async def show_user_info(event: Message, user_id: int, is_edit: bool = False):
-    async with AsyncSessionLocal() as session:
-        user = await get_user(session, user_id)
+async def show_user_info(event: Message, user_id: int, is_edit: bool = False, user: User = None):
+    # user: fresh row from a moderation UPDATE ... RETURNING, skips the lookup
+    card = None if user else get_profile_card(user_id)
+    if card is None:
+        if user is None:
+            async with AsyncSessionLocal() as session:
+                user = await get_user(session, user_id)
         if not user:
             msg = "Пользователь не найден в БД."
             if is_edit: await event.edit_text(msg, reply_markup=main_admin_kb())
             else: await event.answer(msg)
             return
-        
-        status = "✅ Активен"
-        if user.is_banned:
-            status = "🚫 ЗАБАНЕН"
-        elif user.mute_until and user.mute_until > datetime.utcnow():
-            status = f"🔇 В МУТЕ до {format_dt(user.mute_until)}"
-            
-        text = (
-            f"👤 **Профиль пользователя**\n"
-            f"🆔 ID: `{user.user_id}`\n"
-            f"👤 Имя: {user.first_name}\n"
-            f"🔗 Username: @{user.username or 'Нет'}\n"
-            f"📅 Дата регистрации: {format_dt(user.joined_at)}\n"
-            f"📊 Статус: {status}"
-        )
-        
-        kb = get_action_keyboard(user_id, is_banned=user.is_banned)
-        
-        if is_edit:
-            await event.edit_text(text, reply_markup=kb, parse_mode="Markdown")
-        else:
-            await event.answer(text, reply_markup=kb, parse_mode="Markdown")
+        card = render_profile(user)
+
+    text, kb = card
+    if is_edit:
+        await event.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+    else:
+        await event.answer(text, reply_markup=kb, parse_mode="Markdown")
+
+def render_profile(user: User) -> tuple:
+    """Builds the profile card (text, keyboard) and caches it until the next moderation change."""
+    status = "✅ Активен"
+    expires = None
+    if user.is_banned:
+        status = "🚫 ЗАБАНЕН"
+    elif user.mute_until and user.mute_until > datetime.utcnow():
+        status = f"🔇 В МУТЕ до {format_dt(user.mute_until)}"
+        expires = user.mute_until
+
+    text = (
+        f"👤 **Профиль пользователя**\n"
+        f"🆔 ID: `{user.user_id}`\n"
+        f"👤 Имя: {user.first_name}\n"
+        f"🔗 Username: @{user.username or 'Нет'}\n"
+        f"📅 Дата регистрации: {format_dt(user.joined_at)}\n"
+        f"📊 Статус: {status}"
+    )
+    card = (text, get_action_keyboard(user.user_id, is_banned=user.is_banned))
+    set_profile_card(user.user_id, card, expires)
+    return card
+
+@router.callback_query(F.data.startswith("hist:"))
+async def user_history_cb(callback: CallbackQuery):
+    # data: hist:user_id:page[:cursor], newest messages first
+    parts = callback.data.split(":")
+    user_id = int(parts[1])
+    page = int(parts[2])
+    cursor = decode_cursor(parts[3]) if len(parts) > 3 else None
+    limit = 10
+
+    async with AsyncSessionLocal() as session:
+        entries, has_more = await get_user_history(session, user_id, limit, cursor)
+        total = await get_user_history_count(session, user_id)
+
+    lines = [f"📜 История {user_id} (Стр. {page})", ""]
+    for entry in entries:
+        arrow = "➡️" if entry.direction == "in" else f"⬅️ {entry.admin_id}"
+        body = entry.text if entry.text else f"[{entry.content_type}]"
+        lines.append(f"{arrow} {format_dt(entry.created_at)}\n{body}\n")
+    if not entries:
+        lines.append("Сообщений нет.")
+    # Plain text, messages are shown as the user wrote them
+    text = "\n".join(lines)[:4000]
+
+    has_next = has_more if not cursor or cursor[0] == "n" else True
+    prev_cursor = encode_cursor("p", history_cursor_key(entries[0])) if entries else None
+    next_cursor = encode_cursor("n", history_cursor_key(entries[-1])) if entries and has_next else None
+    kb = create_pagination_keyboard(
+        items=[],
+        page=page,
+        total_count=total,
+        items_per_page=limit,
+        callback_prefix=f"hist:{user_id}",
+        keyset=True,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
+    )
+    kb.inline_keyboard.insert(0, [InlineKeyboardButton(text="👤 Профиль", callback_data=f"info:{user_id}")])
+    await callback.message.edit_text(text, reply_markup=kb)
 
 # --- ACTION LOGIC ---
 
@@ -164,27 +300,24 @@ async def show_user_info(event: Message, user_id: int, is_edit: bool = False):
 async def ban_user(callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
     async with AsyncSessionLocal() as session:
-        user = await get_user(session, user_id)
-        if user:
-            user.is_banned = True
-            await session.commit()
-            add_ban(user_id) 
-            await callback.answer("Пользователь забанен.")
-            # Force delay or ensure logic? Database commit is awaited.
-            # We call show_user_info to refresh the view.
-            await show_user_info(callback.message, user_id, is_edit=True)
+        user = await update_user(session, user_id, is_banned=True)
+    if user:
+        add_ban(user_id)
+        bus.publish("ban", user_id)
+        await callback.answer("Пользователь забанен.")
+        # The updated row comes back from the UPDATE, no second query for the card
+        await show_user_info(callback.message, user_id, is_edit=True, user=user)
 
 @router.callback_query(F.data.startswith("unban:"))
 async def unban_user(callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
     async with AsyncSessionLocal() as session:
-        user = await get_user(session, user_id)
-        if user:
-            user.is_banned = False
-            await session.commit()
-            remove_ban(user_id)
-            await callback.answer("Пользователь разбанен.")
-            await show_user_info(callback.message, user_id, is_edit=True)
+        user = await update_user(session, user_id, is_banned=False)
+    if user:
+        remove_ban(user_id)
+        bus.publish("unban", user_id)
+        await callback.answer("Пользователь разбанен.")
+        await show_user_info(callback.message, user_id, is_edit=True, user=user)
 
 # MUTE FSM
 @router.callback_query(F.data.startswith("ask_mute:"))
@@ -206,50 +339,203 @@ async def process_mute_time(message: Message, state: FSMContext):
     user_id = data.get("target_user_id")
     
     async with AsyncSessionLocal() as session:
-        user = await get_user(session, user_id)
-        if user:
-            user.mute_until = datetime.utcnow() + timedelta(minutes=minutes)
-            await session.commit()
-            await message.answer(f"✅ Пользователь {user_id} замучен на {minutes} минут.")
+        user = await update_user(session, user_id, mute_until=datetime.utcnow() + timedelta(minutes=minutes))
+    if user:
+        stats.user_muted(user_id, user.mute_until)
+        set_mute(user_id, user.mute_until)
+        mute_scheduler.schedule(user_id, user.mute_until)
+        bus.publish("mute", user_id, user.mute_until)
+        await message.answer(f"✅ Пользователь {user_id} замучен на {minutes} минут.")
     
     await state.clear()
     # Optionally show updated info
-    await show_user_info(message, user_id)
+    await show_user_info(message, user_id, user=user)
 
 @router.callback_query(F.data.startswith("unmute:"))
 async def unmute_user(callback: CallbackQuery):
     user_id = int(callback.data.split(":")[1])
     async with AsyncSessionLocal() as session:
-        user = await get_user(session, user_id)
-        if user:
-            user.mute_until = None
-            await session.commit()
-            await callback.answer("Пользователь размучен")
-            await show_user_info(callback.message, user_id, is_edit=True)
+        user = await update_user(session, user_id, mute_until=None)
+    if user:
+        stats.user_unmuted(user_id)
+        clear_mute(user_id)
+        mute_scheduler.cancel(user_id)
+        bus.publish("unmute", user_id)
+        await callback.answer("Пользователь размучен")
+        await show_user_info(callback.message, user_id, is_edit=True, user=user)
+
+# --- BULK MODERATION ---
+MAX_ID_FILE_SIZE = 5 * 1024 * 1024
+BULK_VALUES = {
+    "ban": lambda until: {"is_banned": True},
+    "unban": lambda until: {"is_banned": False},
+    "mute": lambda until: {"mute_until": until},
+    "unmute": lambda until: {"mute_until": None},
+}
+
+@router.message(Command("ban", "unban", "mute", "unmute"))
+async def bulk_moderation(message: Message, command: CommandObject, bot):
+    # /ban 1 2 3, /mute <minutes> 1 2 3, or a text file of IDs sent with the command as caption
+    action = command.command
+    args = (command.args or "").split()
+    until = None
+    if action == "mute":
+        if not args or not args[0].isdigit():
+            return await message.answer("Использование: /mute <минуты> <id> [id ...]")
+        until = datetime.utcnow() + timedelta(minutes=int(args.pop(0)))
+
+    text = " ".join(args)
+    if message.document:
+        if (message.document.file_size or 0) > MAX_ID_FILE_SIZE:
+            return await message.answer("❌ Файл слишком большой. Максимальный размер: 5 МБ.")
+        data = await bot.download(message.document)
+        text += "\n" + data.read().decode("utf-8", errors="ignore")
+    user_ids = list(dict.fromkeys(int(x) for x in re.findall(r"\d+", text) if len(x) < 19))
+    if not user_ids:
+        return await message.answer(f"Использование: /{action} <id> [id ...] или файл со списком ID с подписью /{action}")
+
+    async with AsyncSessionLocal() as session:
+        updated = await bulk_update_users(session, user_ids, BULK_VALUES[action](until))
+
+    # Caches, counters and the expiry scheduler in one pass, one bus message for other instances
+    if action == "ban":
+        add_bans(updated)
+    elif action == "unban":
+        remove_bans(updated)
+    elif action == "mute":
+        for user_id in updated:
+            stats.user_muted(user_id, until)
+            set_mute(user_id, until)
+            mute_scheduler.schedule(user_id, until)
+    else:
+        for user_id in updated:
+            stats.user_unmuted(user_id)
+            clear_mute(user_id)
+            mute_scheduler.cancel(user_id)
+    bus.publish_many(action, updated, until)
+
+    summary = f"✅ /{action}: применено к {len(updated)} из {len(user_ids)} ID."
+    found = set(updated)
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        shown = ", ".join(str(user_id) for user_id in missing[:20])
+        more = f" и ещё {len(missing) - 20}" if len(missing) > 20 else ""
+        summary += f"\nНе найдены в БД: {shown}{more}"
+    await message.answer(summary)
+
+# --- EXPORT ---
+@router.message(Command("export"))
+async def export_cmd(message: Message, command: CommandObject, bot):
+    # Usage: /export [csv|jsonl] [gz]
+    args = (command.args or "").lower().split()
+    fmt = next((arg for arg in args if arg in FORMATS), "csv")
+    compress = "gz" in args or "gzip" in args
+    # Runs in the background, the worker is free for other updates right away
+    if not exporter.start(bot, message.chat.id, fmt, compress):
+        return await message.answer("⏳ Экспорт уже выполняется, дождитесь файла.")
+    await message.answer(f"⏳ Готовлю экспорт ({fmt}{', gzip' if compress else ''})...")
+
+# --- DIGEST ---
+@router.message(Command("digest"))
+async def digest_cmd(message: Message, command: CommandObject):
+    # Usage: /digest [on|off]
+    arg = (command.args or "").strip().lower()
+    if arg in ("on", "off"):
+        await digests.set_enabled(message.from_user.id, arg == "on")
+    status = "включён" if message.from_user.id in digests.admins else "выключен"
+    await message.answer(
+        f"🗂 Режим дайджеста {status}.\n"
+        f"При потоке от {digests.busy_rate} сообщений в минуту тексты приходят одним сообщением "
+        f"раз в {digests.interval} с или по {digests.max_items} шт., в спокойное время — сразу.\n"
+        "/digest on — включить, /digest off — выключить"
+    )
+
+# --- IMPORT ---
+@router.message(Command("import"))
+async def import_cmd(message: Message, command: CommandObject, bot):
+    # A CSV/JSONL(.gz) document with caption "/import", or "/import ban" for a ban list
+    if not message.document:
+        return await message.answer(
+            "Отправьте файл CSV/JSONL (можно .gz) с подписью /import\n"
+            "или /import ban, чтобы забанить всех из файла."
+        )
+    if (message.document.file_size or 0) > importer.MAX_DOWNLOAD:
+        return await message.answer("❌ Файл слишком большой. Максимальный размер: 20 МБ.")
+    ban = "ban" in (command.args or "").lower().split()
+    if not importer.start(bot, message.chat.id, message.document, ban):
+        return await message.answer("⏳ Импорт уже выполняется, дождитесь отчёта.")
+    await message.answer("⏳ Импорт запущен, пришлю отчёт по завершении.")
+
+# BROADCAST FSM
+@router.message(Command("broadcast"))
+async def broadcast_cmd(message: Message, state: FSMContext):
+    await state.set_state(AdminStates.waiting_for_broadcast)
+    await message.answer("📢 Отправьте сообщение для рассылки (текст, фото, видео...).")
+
+@router.message(AdminStates.waiting_for_broadcast)
+async def broadcast_preview(message: Message, state: FSMContext):
+    await state.update_data(bc_chat_id=message.chat.id, bc_message_id=message.message_id)
+    async with AsyncSessionLocal() as session:
+        total = await count_broadcast_recipients(session)
+    await message.reply(f"Отправить это сообщение {total} пользователям?", reply_markup=broadcast_confirm_kb())
+
+@router.callback_query(F.data == "bc_confirm")
+async def broadcast_confirm(callback: CallbackQuery, state: FSMContext, bot):
+    data = await state.get_data()
+    await state.clear()
+    if not data.get("bc_message_id"):
+        return await callback.answer("Сообщение для рассылки не найдено.")
+
+    progress = await callback.message.edit_text("📢 Рассылка запускается...")
+    async with AsyncSessionLocal() as session:
+        total = await count_broadcast_recipients(session)
+        broadcast = await create_broadcast(
+            session, callback.message.chat.id, progress.message_id,
+            data["bc_chat_id"], data["bc_message_id"], total
+        )
+    broadcaster.start(bot, broadcast)
+    await progress.edit_text(
+        f"📢 Рассылка #{broadcast.id} запущена: {total} получателей.",
+        reply_markup=broadcast_progress_kb(broadcast.id)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("bc_cancel:"))
+async def broadcast_cancel(callback: CallbackQuery):
+    broadcast_id = int(callback.data.split(":")[1])
+    if await broadcaster.cancel(broadcast_id):
+        await callback.answer("Рассылка будет остановлена.")
+    else:
+        await callback.answer("Рассылка уже завершена.")
 
 # Reply System in Admin
 @router.message(F.reply_to_message)
 async def reply_to_user(message: Message, bot):
-    # Check if admin is replying to a forwarded message OR a bot message with #id tag
+    # Check if admin is replying to a message the bot delivered from a user
     replied_msg = message.reply_to_message
     
-    target_user_id = None
+    async with AsyncSessionLocal() as session:
+        target_user_id = await get_routed_user(session, message.chat.id, replied_msg.message_id)
     
-    # Check text for ID tag (User format: "📩 123456789")
-    text_to_check = replied_msg.text or replied_msg.caption or ""
-    # Regex robust to plain text (no backticks needed in pattern if text attribute strips them)
-    # We look for envelope + digits
-    match = re.search(r"📩\s*(\d+)", text_to_check)
-    if match:
-        target_user_id = int(match.group(1))
+    if not target_user_id:
+        # Messages delivered before routing was recorded and digests: fall back to the ID tag
+        # Check text for ID tag (User format: "📩 123456789")
+        text_to_check = replied_msg.text or replied_msg.caption or ""
+        target_user_id = header_user(text_to_check, message.quote)
+        if target_user_id is None and len(HEADER.findall(text_to_check)) > 1:
+            return await message.reply(
+                "🗂 В дайджесте несколько пользователей: процитируйте (выделите) сообщение того, кому отвечаете."
+            )
     
     if target_user_id:
-        try:
-            # Users must see just message from bot (no "Reply from support" header)
-            await bot.send_message(target_user_id, message.text)
+        # Users must see just message from bot (no "Reply from support" header)
+        # copy_to keeps any content type: text, media, stickers, voice...
+        result = await delivery.send(target_user_id, lambda: message.copy_to(target_user_id))
+        if result.ok:
+            history.record(target_user_id, "out", message, admin_id=message.from_user.id)
             await message.reply("✅ Ответ отправлен.")
-        except Exception as e:
-            await message.answer(f"Ошибка отправки: {e}")
+        else:
+            await message.answer(f"Ошибка отправки: {result.error}")
     else:
         # Maybe just a normal reply between admins? Ignore.
         pass
@@ -2,16 +2,27 @@ import asyncio
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import CommandStart
-from database.db import add_user, AsyncSessionLocal
+from database.db import add_message_routes, AsyncSessionLocal
 from config import ADMIN_IDS
+from utils.delivery import delivery
+from utils.tasks import delayed_actions
+from utils.registration import registration
+from utils.albums import albums, input_media
+from utils.history import history
+from utils.fingerprint import duplicates
+from utils.digest import digests
+from utils.metrics import DROPPED
 
 router = Router()
 
+# Seconds a repeat waits for its original to be delivered, then it is sent on its own
+REPEAT_HOLD = 30
+
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     user = message.from_user
-    async with AsyncSessionLocal() as session:
-        await add_user(session, user_id=user.id, first_name=user.first_name, username=user.username)
+    # Written to DB in batches by the registration task
+    registration.register(user.id, user.first_name, user.username)
     
     await message.answer(
         f"👋 Привет, {user.first_name}!\n"
@@ -30,6 +41,11 @@ async def handle_feedback(message: Message, bot):
         # Silent ignore to prevent recursion and allow Mute FSM to work without "You can't send messages" error
         return
 
+    if message.media_group_id:
+        # Album items arrive one by one, they are forwarded together once complete
+        albums.add(message, lambda messages: forward_album(messages, bot))
+        return
+
     # Format message for admin:
     # We include ID so we can parse it for reply implementation.
     # Format: "#id123456789\nName: ...\nMessage: ..."
@@ -43,36 +59,158 @@ async def handle_feedback(message: Message, bot):
     # Using HTML/MarkdownV2 logic? Let's use simple formatting.
     # User requested: "смайлик конвертика <id> (форматированый, можно скопировать)\nНикнейм (@username)\n\n само сообщение"
     
-    # We strip # from ID to make it just the number for copy
-    info_header = (
-        f"📩 `{user.id}`\n"
-        f"{user.full_name} (@{user.username or 'NoUser'})\n"
-    )
-    
-    admin_received = False
-    for admin_id in ADMIN_IDS:
+    history.record(user.id, "in", message)
+
+    # Spam waves: the same content again within the window is only counted
+    # on the admin messages of the first copy
+    fingerprint = duplicates.fingerprint(message, user.id)
+    entry = None
+    while fingerprint:
+        entry = duplicates.match(fingerprint)
+        if entry is None:
+            entry = duplicates.add(fingerprint, user.id)
+            break
+        # Held until the original is out, if it failed this copy takes its place
         try:
+            await asyncio.wait_for(entry.done.wait(), REPEAT_HOLD)
+        except asyncio.TimeoutError:
+            entry = None
+            break
+        if duplicates.match(fingerprint) is entry:
+            DROPPED.inc("duplicate")
+            entry.repeats += 1
+            entry.users.add(user.id)
+            delayed_actions.schedule(2, lambda: show_repeats(entry, bot), key=("repeats", entry.fingerprint.exact))
+            await confirm(message)
+            return
+
+    # Whatever happens below, copies waiting for this one are let go
+    info_header, routes, queued = None, [], []
+    try:
+        info_header = format_header(user)
+
+        def send_to_admin(admin_id):
             # We add double newline before text
             if message.text:
-                await bot.send_message(admin_id, f"{info_header}\n{message.text}", parse_mode="Markdown")
+                return bot.send_message(admin_id, f"{info_header}\n{message.text}", parse_mode="Markdown")
             elif message.photo or message.video or message.document or message.voice or message.audio:
                 # Copy media with caption
                 caption = f"{info_header}\n{message.caption or ''}"
-                await message.copy_to(admin_id, caption=caption, parse_mode="Markdown")
+                return message.copy_to(admin_id, caption=caption, parse_mode="Markdown")
             else:
-                 await bot.send_message(admin_id, f"{info_header}\n[Неподдерживаемый тип медиа]", parse_mode="Markdown")
-            admin_received = True
-        except Exception as e:
+                return bot.send_message(admin_id, f"{info_header}\n[Неподдерживаемый тип медиа]", parse_mode="Markdown")
+
+        # Under high volume, admins in digest mode get texts combined into one message
+        queued = digests.route(user.id, f"{info_header}\n{message.text}" if message.text else None, ADMIN_IDS)
+        admin_ids = [admin_id for admin_id in ADMIN_IDS if admin_id not in queued]
+        # Routes are taken as soon as admins have the message, before they are stored
+        await deliver_to_admins(message, send_to_admin, admin_ids, queued=bool(queued), on_sent=routes.extend)
+    finally:
+        if entry:
+            remember_original(entry, message, info_header, routes, queued)
+
+def remember_original(entry, message: Message, info_header: str, routes: list, queued: list):
+    """Lets the copies held in handle_feedback go: counted on this one, or sent if it failed."""
+    if not routes and not queued:
+        # Nobody got it, the next copy is sent normally
+        duplicates.remove(entry)
+    else:
+        entry.routes = [(chat_id, message_id) for chat_id, message_id, _ in routes]
+        entry.queued = list(queued)
+        entry.is_caption = bool(not message.text and (
+            message.photo or message.video or message.document or message.voice or message.audio
+        ))
+        body = (message.caption or '') if entry.is_caption else (message.text or '[Неподдерживаемый тип медиа]')
+        entry.sent_text = f"{info_header}\n{body}"
+    entry.done.set()
+
+def format_header(user) -> str:
+    # We strip # from ID to make it just the number for copy
+    return (
+        f"📩 `{user.id}`\n"
+        f"{user.full_name} (@{user.username or 'NoUser'})\n"
+    )
+
+async def show_repeats(entry, bot):
+    # Appends the repeat counter to every admin copy of the original message
+    if entry.sent_text is None:
+        return
+    others = [user_id for user_id in entry.users if user_id != entry.user_id]
+    counter = f"\n\n🔁 Повторов: {entry.repeats}"
+    if others:
+        counter += f", от других пользователей: {len(others)} (" + ", ".join(f"`{user_id}`" for user_id in others[:5])
+        counter += ", …)" if len(others) > 5 else ")"
+    text = entry.sent_text + counter
+
+    def edit(chat_id, message_id):
+        if entry.is_caption:
+            return bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text, parse_mode="Markdown")
+        return bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode="Markdown")
+
+    queued, entry.queued = entry.queued, []
+    await asyncio.gather(*(
+        delivery.send(chat_id, lambda chat_id=chat_id, message_id=message_id: edit(chat_id, message_id))
+        for chat_id, message_id in list(entry.routes)
+    ))
+    # The original is still waiting in their digest: the counter comes as a
+    # message of its own, edited by the next repeats
+    sent = await delivery.fan_out(queued, lambda admin_id: bot.send_message(admin_id, text, parse_mode="Markdown"))
+    new_routes = [(result.chat_id, result.result.message_id) for result in sent if result.ok]
+    if new_routes:
+        async with AsyncSessionLocal() as session:
+            await add_message_routes(session, [(chat_id, message_id, entry.user_id) for chat_id, message_id in new_routes])
+    entry.routes += new_routes
+    entry.queued += [result.chat_id for result in sent if not result.ok]
+
+async def confirm(message: Message):
+    # Ephemeral Success Message
+    sent_msg = await message.answer("✅ Сообщение успешно отправлено!")
+    # Removed message.react to avoid REACTION_INVALID checks failure
+    # Deleted later by the delayed actions task, the handler returns right away
+    delayed_actions.schedule(3, sent_msg.delete)
+
+async def forward_album(messages: list, bot):
+    # One send_media_group per admin instead of one copy per item,
+    # the header goes into the caption of the first item only
+    for item in messages:
+        history.record(item.from_user.id, "in", item)
+    first = messages[0]
+    caption = f"{format_header(first.from_user)}\n{first.caption or ''}"
+    media = [input_media(first, caption=caption, parse_mode="Markdown")]
+    media += [input_media(item) for item in messages[1:]]
+    media = [item for item in media if item]
+    if not media:
+        return
+    digests.route(first.from_user.id, None, ADMIN_IDS)
+    await deliver_to_admins(first, lambda admin_id: bot.send_media_group(admin_id, media))
+
+async def deliver_to_admins(message: Message, make_call, admin_ids=None, queued: bool = False, on_sent=None):
+    """
+    queued: the message also went into a digest, the user is told it was sent.
+    on_sent: called with the routes of the delivered messages before they are stored.
+    """
+    user = message.from_user
+    # All admins at once, rate limits and retries are handled by the delivery engine
+    results = await delivery.fan_out(ADMIN_IDS if admin_ids is None else admin_ids, make_call)
+    for result in results:
+        if not result.ok:
             # Log error
-            print(f"FAILED TO SEND TO ADMIN {admin_id}: {e}")
-            pass
-
-    if admin_received:
-        # Ephemeral Success Message
-        sent_msg = await message.answer("✅ Сообщение успешно отправлено!")
-        # Removed message.react to avoid REACTION_INVALID checks failure
-        await asyncio.sleep(3)
-        try:
-            await sent_msg.delete()
-        except:
-            pass
+            print(f"FAILED TO SEND TO ADMIN {result.chat_id}: {result.error}")
+    admin_received = any(result.ok for result in results)
+
+    # Remember which user each admin-side message belongs to, replies are routed by it
+    # (an album is a list of messages, each of them can be replied to)
+    routes = [
+        (result.chat_id, sent.message_id, user.id)
+        for result in results if result.ok
+        for sent in (result.result if isinstance(result.result, list) else [result.result])
+    ]
+    if on_sent:
+        on_sent(routes)
+    if routes:
+        async with AsyncSessionLocal() as session:
+            await add_message_routes(session, routes)
+
+    if admin_received or queued:
+        await confirm(message)
+    return routes
@@ -0,0 +1,55 @@
+"""
+Bulk import of users and ban lists from the command line.
+
+Same format as the admin /import: CSV with a header, an /export file,
+JSONL, or one user_id per line, optionally gzipped.
+
+The running bot keeps bans, mutes and counters in memory. They are reloaded
+through the Redis bus (REDIS_URL), so without it the import is refused:
+use /import in the bot instead, or pass --offline and restart the bot after.
+
+Usage:
+    python import_users.py users.csv
+    python import_users.py blocklist.txt --ban
+    python import_users.py users.csv --offline
+"""
+import argparse
+import asyncio
+import sys
+
+from database.db import init_db, engine
+from utils.importer import import_users
+from utils.shared_state import bus
+
+
+async def run(args):
+    await init_db()
+    try:
+        with open(args.path, "rb") as f:
+            report = await import_users(f, ban=args.ban, batch_size=args.batch_size)
+        reloaded = await bus.publish_now("reload")
+    finally:
+        await engine.dispose()
+    print(report.summary())
+    if not reloaded:
+        print("⚠️ Запущенный бот не получил уведомление: перезапустите его, чтобы применить импорт")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Import users into the bot database")
+    parser.add_argument("path", help="CSV/JSONL file, .gz is detected automatically")
+    parser.add_argument("--ban", action="store_true", help="ban every user in the file")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--offline", action="store_true",
+                        help="import without Redis, the bot has to be restarted afterwards")
+    args = parser.parse_args()
+    if bus.client is None and not args.offline:
+        parser.error("REDIS_URL is not set (or redis is not installed): the running bot would not "
+                     "see the import. Use /import in the bot, or --offline and restart the bot.")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    main_cli()
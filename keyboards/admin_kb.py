@@ -1,5 +1,8 @@
+from functools import lru_cache
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+# Static keyboards are built once and reused
+@lru_cache(maxsize=None)
 def main_admin_kb():
     kb = [
         [
@@ -28,6 +31,23 @@ def get_action_keyboard(user_id: int, is_banned: bool = False):
         [
              InlineKeyboardButton(text="🔉 Анмут", callback_data=f"unmute:{user_id}"),
              InlineKeyboardButton(text="🔙 Назад", callback_data="admin_home")
+        ],
+        [
+            InlineKeyboardButton(text="📜 История", callback_data=f"hist:{user_id}:1")
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+@lru_cache(maxsize=None)
+def broadcast_confirm_kb():
+    kb = [
+        [
+            InlineKeyboardButton(text="📢 Отправить", callback_data="bc_confirm"),
+            InlineKeyboardButton(text="❌ Отмена", callback_data="admin_home")
         ]
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def broadcast_progress_kb(broadcast_id: int):
+    kb = [[InlineKeyboardButton(text="🛑 Остановить", callback_data=f"bc_cancel:{broadcast_id}")]]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
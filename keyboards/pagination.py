@@ -8,7 +8,10 @@ def create_pagination_keyboard(
     items_per_page: int,
     callback_prefix: str,
     item_key: str = "user_id", # Attribute to use for callback ID
-    item_label: str = "first_name" # Attribute to use for button text
+    item_label: str = "first_name", # Attribute to use for button text
+    keyset: bool = False, # Navigate with cursors instead of page numbers
+    prev_cursor: str = None, # See encode_cursor
+    next_cursor: str = None # None in keyset mode = no next page
 ) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -33,12 +36,18 @@ def create_pagination_keyboard(
     # Calculate max pages (avoid division by zero if total_count is 0, though items check handles empty list)
     max_page = (total_count + items_per_page - 1) // items_per_page
     if max_page < 1: max_page = 1
+    # Counter may lag behind while users are joining
+    if max_page < page: max_page = page
     
     nav_row = []
     
     # Back Arrow
     if page > 1:
-        nav_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"{callback_prefix}:{page-1}"))
+        # Page 1 never needs a cursor
+        back_data = f"{callback_prefix}:{page-1}"
+        if keyset and prev_cursor and page > 2:
+            back_data += f":{prev_cursor}"
+        nav_row.append(InlineKeyboardButton(text="⬅️", callback_data=back_data))
     else:
          # Placeholder to keep alignment if desired, or just omit. Omit is cleaner.
          pass
@@ -47,10 +56,23 @@ def create_pagination_keyboard(
     nav_row.append(InlineKeyboardButton(text=f"{page}/{max_page}", callback_data="noop"))
     
     # Forward Arrow
-    if page < max_page:
+    if keyset:
+        if next_cursor:
+            nav_row.append(InlineKeyboardButton(text="➡️", callback_data=f"{callback_prefix}:{page+1}:{next_cursor}"))
+    elif page < max_page:
         nav_row.append(InlineKeyboardButton(text="➡️", callback_data=f"{callback_prefix}:{page+1}"))
         
     builder.row(*nav_row)
     builder.row(InlineKeyboardButton(text="🔙 Назад в меню", callback_data="admin_home"))
     
     return builder.as_markup()
+
+
+def encode_cursor(direction: str, key: tuple) -> str:
+    # "n" = rows after key, "p" = rows before key. Fits in 64-byte callback data.
+    return direction + "_".join(str(part) for part in key)
+
+def decode_cursor(data: str):
+    if not data:
+        return None
+    return data[0], tuple(int(part) for part in data[1:].split("_"))
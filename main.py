@@ -2,64 +2,135 @@ import asyncio
 import logging
 import sys
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 # Webhook imports
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
 
-from config import BOT_TOKEN, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_URL, WEBAPP_HOST, WEBAPP_PORT
-from database.db import init_db
+from config import (
+    BOT_TOKEN, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_URL, WEBAPP_HOST, WEBAPP_PORT,
+    INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_MAX_AGE, METRICS_PORT, METRICS_HOST,
+    INGEST_ADMIN_WORKERS, INGEST_ADMIN_QUEUE_SIZE, INGEST_ADMIN_SLO, INGEST_USER_SLO
+)
+from database.db import init_db, warm_stats, AsyncSessionLocal
 from handlers import user, admin
 from middlewares.throttling import ThrottlingMiddleware
 from middlewares.checks import BanMuteMiddleware
 from middlewares.media import MediaSizeMiddleware
-from utils.tasks import check_expired_mutes
+from utils.tasks import check_expired_mutes, delayed_actions, route_retention
+from utils.shared_state import bus, create_fsm_storage
+from utils.ingest import UpdateQueue
+from utils.registration import registration
+from utils.broadcast import broadcaster
+from utils.albums import albums
+from utils.history import history
+from utils.digest import digests
+from utils import metrics
+from utils.metrics import (
+    InstrumentedMiddleware, UpdateMetricsMiddleware, HandlerMetricsMiddleware, ApiMetricsMiddleware
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
 # Initialize Bot and Dispatcher
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+bot.session.middleware(ApiMetricsMiddleware())
+# FSM in Redis when REDIS_URL is set, so any instance can continue a dialog
+dp = Dispatcher(storage=create_fsm_storage())
 
 # Register Middlewares
+# 0. Metrics for every update
+dp.update.outer_middleware(UpdateMetricsMiddleware())
 # 1. Throttling (First to block spam early)
-dp.message.middleware(ThrottlingMiddleware(limit=10))
+dp.message.middleware(InstrumentedMiddleware(ThrottlingMiddleware(limit=10)))
 # 2. Ban/Mute Checks
-dp.message.middleware(BanMuteMiddleware())
+dp.message.middleware(InstrumentedMiddleware(BanMuteMiddleware()))
 # 3. Media Size Check
-dp.message.middleware(MediaSizeMiddleware(limit_mb=50))
+dp.message.middleware(InstrumentedMiddleware(MediaSizeMiddleware(limit_mb=50)))
+# 4. Handler timing (last, wraps only the handler)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
 
 # Register Routers
 dp.include_router(admin.router)
 dp.include_router(user.router)
 
+# Updates are queued and processed by a fixed worker pool in both modes
+update_queue = UpdateQueue(
+    dp, bot, workers=INGEST_WORKERS, maxsize=INGEST_QUEUE_SIZE, max_age=INGEST_MAX_AGE,
+    admin_ids=ADMIN_IDS, admin_workers=INGEST_ADMIN_WORKERS, admin_maxsize=INGEST_ADMIN_QUEUE_SIZE,
+    slo={"admin": INGEST_ADMIN_SLO, "user": INGEST_USER_SLO}
+)
+INGEST_GAUGES = ("depth", "admin_depth", "busy", "admin_busy", "utilisation")
+INGEST_COUNTERS = ("processed", "rejected", "shed", "failed")
+metrics.INGEST_QUEUE.set_function(
+    lambda: {(field,): value for field, value in update_queue.snapshot().items() if field in INGEST_GAUGES}
+)
+metrics.INGEST_UPDATES.set_function(
+    lambda: {(field,): value for field, value in update_queue.snapshot().items() if field in INGEST_COUNTERS}
+)
+
+async def warm_up():
+    async with AsyncSessionLocal() as session:
+        await warm_stats(session)
+
+background_tasks = []
+
 async def on_startup(bot: Bot):
     await init_db()
+    await warm_up()
+    await digests.load(bot)
+    update_queue.start()
     # Start background tasks
-    asyncio.create_task(check_expired_mutes())
+    background_tasks.append(asyncio.create_task(update_queue.log_status()))
+    background_tasks.append(asyncio.create_task(metrics.monitor_event_loop()))
+    background_tasks.append(asyncio.create_task(check_expired_mutes()))
+    background_tasks.append(asyncio.create_task(delayed_actions.run()))
+    background_tasks.append(asyncio.create_task(history.run_retention()))
+    background_tasks.append(asyncio.create_task(route_retention.run()))
+    # Write-behind buffers are stopped (and flushed) on shutdown, not cancelled
+    asyncio.create_task(registration.run())
+    asyncio.create_task(history.run())
+    asyncio.create_task(digests.run())
+    if bus.client:
+        # Ban/mute changes from other instances
+        background_tasks.append(asyncio.create_task(bus.run()))
+    # Broadcasts interrupted by the last shutdown continue from their checkpoint
+    await broadcaster.resume_all(bot)
     
     if USE_WEBHOOK:
         await bot.set_webhook(WEBHOOK_URL)
         logging.info(f"✅ Webhook set to: {WEBHOOK_URL}")
 
 async def on_shutdown(bot: Bot):
+    await update_queue.stop()
+    for task in background_tasks:
+        task.cancel()
+    await broadcaster.stop()
+    # Albums still being collected go out before their confirmations are cleaned up
+    await albums.flush()
+    await digests.stop()
+    # Run pending deletions instead of leaving confirmations behind
+    await delayed_actions.flush()
+    # Users who pressed /start since the last batch
+    await registration.stop()
+    await history.stop()
+
     if USE_WEBHOOK:
         await bot.delete_webhook()
 
 async def main():
+    # Both modes emit startup/shutdown (polling below, webhook via setup_application)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
     if USE_WEBHOOK:
         # Webhook Mode
-        dp.startup.register(on_startup)
-        dp.shutdown.register(on_shutdown)
-        
         app = web.Application()
         
-        webhook_requests_handler = SimpleRequestHandler(
-            dispatcher=dp,
-            bot=bot,
-        )
-        webhook_requests_handler.register(app, path="/webhook")
+        # Acknowledge at once, workers process the update (GET /status shows the queue)
+        update_queue.register(app, path="/webhook")
+        metrics.register(app)
         
         setup_application(app, dp, bot=bot)
         
@@ -70,14 +141,26 @@ async def main():
         await site.start()
         
         # Keep alive
-        await asyncio.Event().wait()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
     else:
         # Polling Mode
-        await init_db()
-        asyncio.create_task(check_expired_mutes()) # Start task in polling too
         print("🚀 Starting Polling...")
+        metrics_runner = None
+        if METRICS_PORT:
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+            print(f"📈 Metrics on {METRICS_HOST}:{METRICS_PORT}/metrics")
         await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        try:
+            await update_queue.poll()
+        finally:
+            await dp.emit_shutdown(bot=bot, dispatcher=dp)
+            await bot.session.close()
+            if metrics_runner:
+                await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     try:
@@ -1,8 +1,9 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 from datetime import datetime
-from database.db import get_user, AsyncSessionLocal
-from utils.cache import is_banned, add_ban
+from database.db import get_user, clear_blocked, AsyncSessionLocal
+from utils.metrics import DROPPED
+from utils.cache import is_banned, add_ban, get_mute, set_mute, mark_mute_notified, MUTE_UNKNOWN, BLOCKED_USERS
 
 class BanMuteMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
@@ -10,30 +11,39 @@ class BanMuteMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         user_id = event.from_user.id
+
+        # 0. Writing to the bot (/start included) means it is unblocked again
+        if user_id in BLOCKED_USERS:
+            async with AsyncSessionLocal() as session:
+                await clear_blocked(session, user_id)
         
         # 1. Check Memory Cache for Ban
         if is_banned(user_id):
+            DROPPED.inc("banned")
             return # Silent ignore
 
-        # 2. Check DB for Mute (and sync Ban if needed, though we try to keep cache updated)
-        # We also need to populate cache on startup, but for safety we can check DB if not in cache?
-        # The prompt optimization strategy was: Check cache, update it when action happens.
-        # But if we restart, cache is empty. So we should probably check DB if we want persistence.
-        # However, to strictly follow "reduce DB hits", we rely on cache.
-        # Standard approach: Load bans on startup.
-        
-        # Check for Mute in DB (Mutes are time-based, better checked in DB or another cache)
-        async with AsyncSessionLocal() as session:
-            user = await get_user(session, user_id)
-            if user:
-                # Sync Ban to cache if found in DB but not in cache (e.g. after restart)
-                if user.is_banned:
-                    add_ban(user_id)
-                    return # Silent ignore
-                
-                if user.mute_until and user.mute_until > datetime.utcnow():
-                    remaining = (user.mute_until - datetime.utcnow()).seconds
-                    await event.answer(f"⏳ You are muted for {remaining} seconds.")
-                    return
+        # 2. Check Memory Cache for Mute, DB only on a cache miss
+        # Bans and active mutes are warmed on startup, misses are cached
+        # as "not muted" so regular users cost zero DB round trips.
+        mute_until = get_mute(user_id)
+        if mute_until is MUTE_UNKNOWN:
+            async with AsyncSessionLocal() as session:
+                user = await get_user(session, user_id)
+            # Sync Ban to cache if found in DB but not in cache
+            if user and user.is_banned:
+                add_ban(user_id)
+                DROPPED.inc("banned")
+                return # Silent ignore
+            mute_until = user.mute_until if user else None
+            set_mute(user_id, mute_until)
+
+        now = datetime.utcnow()
+        if mute_until and mute_until > now:
+            DROPPED.inc("muted")
+            # Tell the user once per mute, not once per message
+            if mark_mute_notified(user_id):
+                remaining = (mute_until - now).seconds
+                await event.answer(f"⏳ You are muted for {remaining} seconds.")
+            return
 
         return await handler(event, data)
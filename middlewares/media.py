@@ -1,5 +1,6 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
+from utils.metrics import DROPPED
 
 class MediaSizeMiddleware(BaseMiddleware):
     def __init__(self, limit_mb: int = 50):
@@ -23,6 +24,7 @@ class MediaSizeMiddleware(BaseMiddleware):
         # Photos are usually small, but strict check would check largest size
         
         if file_size > self.limit_bytes:
+            DROPPED.inc("too_large")
             await event.answer("❌ Файл слишком большой. Максимальный размер: 50 МБ.")
             return # Stop propagation
 
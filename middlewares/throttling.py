@@ -1,8 +1,12 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
-from cachetools import TTLCache
-from config import REDIS_URL
+from config import REDIS_URL, ADMIN_IDS, THROTTLE_BURST, THROTTLE_TWO_TIER
+from utils.metrics import DROPPED
 import asyncio
+import heapq
+import math
+import time
+from cachetools import LRUCache
 
 # Optional import for Redis
 try:
@@ -10,46 +14,150 @@ try:
 except ImportError:
     redis = None
 
+# Token bucket as GCRA: one "theoretical arrival time" per user.
+# A message is allowed while tat - now <= (burst - 1) * interval,
+# each allowed message pushes tat forward by one interval.
+# Returns 0 if allowed, otherwise milliseconds until the next token.
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+if tat - now > tolerance then
+    return tat - tolerance - now
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tat, 'PX', tat - now)
+return 0
+"""
+
+
+class LocalRateLimiter:
+    """
+    In-process GCRA. Idle users cost nothing: every entry is also filed under
+    the `resolution` step in which its bucket is full again, and only the keys
+    of the steps that are over get checked, never the whole table at once.
+    """
+    def __init__(self, interval: float, burst: int = 1, resolution: float = 1.0):
+        self.interval = interval
+        self.tolerance = (burst - 1) * interval
+        self.resolution = resolution
+        self._tat = {}  # user_id -> theoretical arrival time (monotonic seconds)
+        self._expiry = {}  # rounded-up tat -> keys that may be idle from then on
+        self._heap = []  # rounded-up tats, earliest first
+
+    def hit(self, key: int, now: float) -> float:
+        """Returns 0 if allowed, otherwise seconds to wait."""
+        if self._heap and self._heap[0] <= now:
+            self._sweep(now)
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > self.tolerance:
+            return tat - self.tolerance - now
+        self._set(key, tat + self.interval)
+        return 0
+
+    def block(self, key: int, seconds: float, now: float):
+        # Deny locally until `seconds` from now
+        self._set(key, max(self._tat.get(key, now), now + seconds + self.tolerance))
+
+    def _set(self, key: int, tat: float):
+        self._tat[key] = tat
+        deadline = math.ceil(tat / self.resolution) * self.resolution
+        keys = self._expiry.get(deadline)
+        if keys is None:
+            keys = self._expiry[deadline] = set()
+            heapq.heappush(self._heap, deadline)
+        keys.add(key)
+
+    def _sweep(self, now: float):
+        while self._heap and self._heap[0] <= now:
+            for key in self._expiry.pop(heapq.heappop(self._heap)):
+                # A key hit since then is filed under a later step as well
+                if self._tat.get(key, now) <= now:
+                    self._tat.pop(key, None)
+
+
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, limit: int = 10):
+    def __init__(self, limit: float = 10, burst: int = THROTTLE_BURST, two_tier: bool = THROTTLE_TWO_TIER):
+        # One message per `limit` seconds on average, up to `burst` at once
         self.limit = limit
+        self.burst = burst
         self.use_redis = False
+        self.two_tier = False
         self.redis_client = None
-        self.cache = None
+        self.local = LocalRateLimiter(limit, burst)
+        # An album arrives as several messages at once, it counts as one:
+        # media_group_id -> future with the decision made for its first item
+        self.albums = LRUCache(maxsize=10000)
 
         if REDIS_URL and redis:
             try:
                 self.redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+                self.gcra = self.redis_client.register_script(GCRA_SCRIPT)
                 self.use_redis = True
-                print("✅ Throttling: Using Redis")
+                self.two_tier = two_tier
+                print(f"✅ Throttling: Using Redis{' (two-tier)' if self.two_tier else ''}")
             except Exception as e:
                 print(f"⚠️ Redis Init Failed: {e}. Fallback to Memory.")
                 self.use_redis = False
-        
-        if not self.use_redis:
-            # Fallback
-            self.cache = TTLCache(maxsize=10000, ttl=limit)
+
+    async def _redis_hit(self, user_id: int) -> float:
+        """Returns 0 if allowed, otherwise seconds to wait. One atomic round trip."""
+        interval_ms = int(self.limit * 1000)
+        retry_ms = await self.gcra(
+            keys=[f"throttle:{user_id}"],
+            args=[interval_ms, (self.burst - 1) * interval_ms]
+        )
+        return int(retry_ms) / 1000
 
     async def __call__(self, handler, event: Message, data: dict):
         if not isinstance(event, Message):
             return await handler(event, data)
-        
+
         user_id = event.from_user.id
-        
+        if user_id in ADMIN_IDS:
+            # Admin flows (e.g. /broadcast, then the message) send several messages in a row
+            return await handler(event, data)
+
+        if event.media_group_id:
+            decision = self.albums.get(event.media_group_id)
+            if decision is None:
+                decision = self.albums[event.media_group_id] = asyncio.get_running_loop().create_future()
+                try:
+                    decision.set_result(await self._throttled(user_id))
+                finally:
+                    if not decision.done():
+                        decision.set_result(False)
+            throttled = await decision
+        else:
+            throttled = await self._throttled(user_id)
+
+        if throttled:
+            DROPPED.inc("throttled")
+            return # Throttled
+        return await handler(event, data)
+
+    async def _throttled(self, user_id: int) -> bool:
+        now = time.monotonic()
+
         if self.use_redis:
-            key = f"throttle:{user_id}"
+            # Two-tier: a local deny is final (this instance alone already used the budget),
+            # only users the local bucket lets through are checked against the shared one.
+            if self.two_tier and self.local.hit(user_id, now):
+                return True
             try:
-                exists = await self.redis_client.get(key)
-                if exists:
-                    return # Throttled
-                
-                await self.redis_client.set(key, "1", ex=self.limit)
+                wait = await self._redis_hit(user_id)
+                if wait:
+                    if self.two_tier:
+                        self.local.block(user_id, wait, now)
+                    return True
             except Exception as e:
                 print(f"Redis Error: {e}")
                 # Fail open or closed? Fail open (allow message) to not block user on db error
-        else:
-            if user_id in self.cache:
-                return # Throttled
-            self.cache[user_id] = True
-            
-        return await handler(event, data)
+            return False
+
+        return bool(self.local.hit(user_id, now))
@@ -0,0 +1,193 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage, EditMessageText
+from aiogram.types import Message
+
+from database import db
+from handlers import user as feedback
+from utils.fingerprint import duplicates
+from utils.tasks import delayed_actions
+
+ADMIN_ID = 100
+# Different enough not to be near-duplicates of each other
+SPAM = [
+    "Заработай 5000 рублей в день не выходя из дома, подробности в личке",
+    "Бесплатные подписчики для вашего канала, пишите прямо сейчас",
+    "Крипто-сигналы с гарантией прибыли, вступай в закрытый клуб",
+    "Срочно продам аккаунт с редкими скинами, торг уместен",
+    "Лучшие ставки на спорт только у нас, бонус новым игрокам",
+]
+
+
+class AdminAPI(BaseSession):
+    """Fake Bot API: messages to the admin wait for `release`, the first `failures` of them fail."""
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+        self.failures = 0
+        self.admin_texts = []
+        self.edits = []
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage) and method.chat_id == ADMIN_ID:
+            await self.release.wait()
+            if self.failures:
+                self.failures -= 1
+                raise TelegramBadRequest(method=method, message="Bad Request: chat not found")
+            self.admin_texts.append(method.text)
+        if isinstance(method, EditMessageText):
+            self.edits.append(method.text)
+            return True
+        self._message_id += 1
+        return Message.model_validate({
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": getattr(method, "chat_id", None) or 1, "type": "private"},
+            "text": getattr(method, "text", None),
+        }, context={"bot": bot})
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def run(coro):
+    async def wrapper():
+        await db.init_db()
+        try:
+            await coro
+        finally:
+            await delayed_actions.flush()
+            await db.engine.dispose()
+    asyncio.run(wrapper())
+
+
+def message(bot: Bot, user_id: int, text: str) -> Message:
+    return Message.model_validate({
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        "text": text,
+    }, context={"bot": bot})
+
+
+def test_repeat_while_original_is_sent_is_counted_on_it(monkeypatch):
+    monkeypatch.setattr(feedback, "ADMIN_IDS", [ADMIN_ID])
+
+    async def check():
+        api = AdminAPI()
+        bot = Bot(token="123456:TEST", session=api)
+        text = SPAM[0]
+        original = asyncio.create_task(feedback.handle_feedback(message(bot, 1, text), bot))
+        await asyncio.sleep(0.05)
+        repeat = asyncio.create_task(feedback.handle_feedback(message(bot, 2, text), bot))
+        await asyncio.sleep(0.05)
+        assert not repeat.done()  # held until the original is out
+
+        api.release.set()
+        await asyncio.gather(original, repeat)
+        entry = duplicates.match(duplicates.fingerprint(message(bot, 2, text), 2))
+        assert len(api.admin_texts) == 1
+        assert entry.repeats == 1 and entry.users == {2}
+
+        await delayed_actions.flush()
+        assert len(api.edits) == 1
+        assert api.edits[0].startswith(entry.sent_text) and "🔁 Повторов: 1" in api.edits[0]
+
+    run(check())
+
+
+def test_repeat_of_failed_original_is_sent(monkeypatch):
+    monkeypatch.setattr(feedback, "ADMIN_IDS", [ADMIN_ID])
+
+    async def check():
+        api = AdminAPI()
+        api.failures = 1
+        bot = Bot(token="123456:TEST", session=api)
+        text = SPAM[1]
+        original = asyncio.create_task(feedback.handle_feedback(message(bot, 1, text), bot))
+        await asyncio.sleep(0.05)
+        repeat = asyncio.create_task(feedback.handle_feedback(message(bot, 2, text), bot))
+        await asyncio.sleep(0.05)
+
+        api.release.set()
+        await asyncio.gather(original, repeat)
+        # The copy took the place of the original that nobody received
+        assert len(api.admin_texts) == 1 and api.admin_texts[0].startswith("📩 `2`")
+        entry = duplicates.match(duplicates.fingerprint(message(bot, 3, text), 3))
+        assert entry.user_id == 2 and entry.repeats == 0
+
+    run(check())
+
+
+def test_original_that_raised_lets_repeats_go(monkeypatch):
+    monkeypatch.setattr(feedback, "ADMIN_IDS", [ADMIN_ID])
+
+    route = feedback.digests.route
+
+    def broken_route(*args):
+        # Only the first call fails
+        monkeypatch.setattr(feedback.digests, "route", route)
+        raise RuntimeError("digest queue broken")
+
+    async def check():
+        api = AdminAPI()
+        api.release.set()
+        bot = Bot(token="123456:TEST", session=api)
+        text = SPAM[3]
+        monkeypatch.setattr(feedback.digests, "route", broken_route)
+        try:
+            await feedback.handle_feedback(message(bot, 1, text), bot)
+        except RuntimeError:
+            pass
+        # Not held behind the failed original, sent in its place
+        await asyncio.wait_for(feedback.handle_feedback(message(bot, 2, text), bot), 5)
+        assert len(api.admin_texts) == 1 and api.admin_texts[0].startswith("📩 `2`")
+
+    run(check())
+
+
+def test_original_is_kept_when_storing_routes_fails(monkeypatch):
+    monkeypatch.setattr(feedback, "ADMIN_IDS", [ADMIN_ID])
+
+    async def broken_store(session, routes):
+        raise RuntimeError("database is locked")
+
+    async def check():
+        api = AdminAPI()
+        api.release.set()
+        bot = Bot(token="123456:TEST", session=api)
+        text = SPAM[4]
+        monkeypatch.setattr(feedback, "add_message_routes", broken_store)
+        try:
+            await feedback.handle_feedback(message(bot, 1, text), bot)
+        except RuntimeError:
+            pass
+        await feedback.handle_feedback(message(bot, 2, text), bot)
+        # Admins already have the original: the copy is only counted on it
+        assert len(api.admin_texts) == 1
+        entry = duplicates.match(duplicates.fingerprint(message(bot, 3, text), 3))
+        assert entry.user_id == 1 and entry.routes and entry.repeats == 1
+
+    run(check())
+
+
+def test_show_repeats_without_sent_text_does_nothing():
+    async def check():
+        api = AdminAPI()
+        bot = Bot(token="123456:TEST", session=api)
+        entry = duplicates.add(duplicates.fingerprint(message(bot, 1, SPAM[2]), 1), 1)
+        entry.repeats = 1
+        await feedback.show_repeats(entry, bot)
+        assert api.edits == []
+        duplicates.remove(entry)
+
+    run(check())
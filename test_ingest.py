@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from aiogram.types import Update
+
+from utils.ingest import UpdateQueue
+from utils.metrics import LANE_SLO
+
+ADMIN_ID = 100
+
+
+class SlowDispatcher:
+    """Stands in for the Dispatcher: user updates take `user_delay` seconds."""
+    def __init__(self, user_delay: float = 0):
+        self.user_delay = user_delay
+        self.processed = []  # (update_id, when)
+
+    async def feed_update(self, bot, update: Update):
+        if update.message.from_user.id != ADMIN_ID:
+            await asyncio.sleep(self.user_delay)
+        self.processed.append((update.update_id, time.monotonic()))
+
+
+def message(update_id: int, user_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": "hi",
+        },
+    })
+
+
+def test_admin_update_is_processed_while_user_lane_is_full():
+    async def check():
+        dispatcher = SlowDispatcher(user_delay=10)
+        queue = UpdateQueue(dispatcher, None, workers=2, maxsize=5, admin_ids={ADMIN_ID}, admin_workers=1)
+        queue.start()
+        try:
+            # Both shared workers stuck on user updates, the lane full behind them
+            for update_id in range(2):
+                assert queue.submit(message(update_id, 1))
+            await asyncio.sleep(0.05)
+            for update_id in range(2, 20):
+                assert queue.submit(message(update_id, 1))
+            assert queue.queue.full() and queue.busy == 2
+
+            started = time.monotonic()
+            assert queue.submit(message(100, ADMIN_ID))
+            for _ in range(50):
+                if dispatcher.processed:
+                    break
+                await asyncio.sleep(0.01)
+            assert [update_id for update_id, _ in dispatcher.processed] == [100]
+            assert dispatcher.processed[0][1] - started < 0.5
+        finally:
+            for task in queue._tasks:
+                task.cancel()
+            await asyncio.gather(*queue._tasks, return_exceptions=True)
+
+    asyncio.run(check())
+
+
+def test_full_user_lane_drops_the_oldest_update():
+    async def check():
+        shed_before = LANE_SLO._values.get(("user", "shed"), 0)
+        queue = UpdateQueue(SlowDispatcher(), None, workers=1, maxsize=3, admin_ids={ADMIN_ID})
+        for update_id in range(5):
+            assert queue.submit(message(update_id, 1))
+
+        assert [update.update_id for _, update in queue.queue._queue] == [2, 3, 4]
+        assert queue.shed == 2
+        assert LANE_SLO._values.get(("user", "shed"), 0) - shed_before == 2
+        # One wakeup per queued update, the evicted ones gave theirs over
+        assert queue._available._value == 3
+
+    asyncio.run(check())
+
+
+def test_put_waits_for_room_in_the_admin_lane():
+    async def check():
+        dispatcher = SlowDispatcher()
+        queue = UpdateQueue(dispatcher, None, workers=0, admin_ids={ADMIN_ID},
+                            admin_workers=1, admin_maxsize=1)
+        await queue.put(message(1, ADMIN_ID))
+        waiting = asyncio.create_task(queue.put(message(2, ADMIN_ID)))
+        await asyncio.sleep(0.05)
+        assert not waiting.done() and queue.rejected == 0
+
+        queue.start()
+        try:
+            await asyncio.wait_for(waiting, 1)
+            await asyncio.wait_for(queue.admin_queue.join(), 1)
+            assert [update_id for update_id, _ in dispatcher.processed] == [1, 2]
+        finally:
+            await queue.stop()
+
+    asyncio.run(check())
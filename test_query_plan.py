@@ -0,0 +1,80 @@
+import asyncio
+from datetime import timedelta
+
+# Test DB from conftest, also when run as a script (under pytest it is loaded already)
+import conftest  # noqa: F401
+from sqlalchemy import event
+from database import db
+from database.migrations import MIGRATIONS, get_schema_version
+
+
+async def capture_plans(query):
+    """Runs a db helper and returns EXPLAIN QUERY PLAN details of the SQL it executed."""
+    statements = []
+
+    def remember(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE")):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine.sync_engine, "before_cursor_execute", remember)
+    try:
+        async with db.AsyncSessionLocal() as session:
+            await query(session)
+    finally:
+        event.remove(db.engine.sync_engine, "before_cursor_execute", remember)
+
+    plans = []
+    async with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plans.append(" | ".join(row[-1] for row in result.all()))
+    return plans
+
+
+def run(coro):
+    async def wrapper():
+        try:
+            await coro
+        finally:
+            # Pooled connections belong to this event loop
+            await db.engine.dispose()
+    asyncio.run(wrapper())
+
+
+def test_schema_is_migrated():
+    async def check():
+        await db.init_db()
+        async with db.engine.connect() as conn:
+            assert await get_schema_version(conn) == MIGRATIONS[-1][0]
+            journal = (await conn.exec_driver_sql("PRAGMA journal_mode")).scalar()
+            assert journal.lower() == "wal"
+    run(check())
+
+
+def test_moderation_queries_use_indexes():
+    async def check():
+        await db.init_db()
+        cases = {
+            "ix_users_banned": lambda s: db.get_banned_paginated(s, 10, ("n", (100,))),
+            "ix_users_mute_until": lambda s: db.get_muted_paginated(s, 10),
+            "ix_users_joined_at": lambda s: db.get_new_users_period(s, timedelta(days=1)),
+            "ix_feedback_user_created": lambda s: db.get_user_history(s, 1, 10, ("n", (10 ** 15, 5))),
+        }
+        for index, query in cases.items():
+            plans = await capture_plans(query)
+            assert plans and all(index in plan for plan in plans), (index, plans)
+
+        # Users list and counters walk the primary key, never a full scan of the table rows
+        plans = await capture_plans(lambda s: db.get_users_paginated(s, 10, ("n", (100,))))
+        assert all("SCAN users" not in plan or "INDEX" in plan for plan in plans), plans
+
+        # /find goes through the FTS index, never LIKE over users
+        plans = await capture_plans(lambda s: db.search_users(s, "user", 10, ("n", (100,))))
+        assert plans and all("users_fts VIRTUAL TABLE INDEX" in plan for plan in plans), plans
+    run(check())
+
+
+if __name__ == "__main__":
+    test_schema_is_migrated()
+    test_moderation_queries_use_indexes()
+    print("Query plans OK")
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import fakeredis
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.redis import RedisStorage
+
+from database import db
+from database.db import AsyncSessionLocal, User
+from utils.cache import BANNED_USERS, MUTE_UNKNOWN, get_mute, set_mute
+from utils.shared_state import InvalidationBus
+from utils.stats import stats
+from utils.tasks import MuteExpiryScheduler
+
+
+def run(coro):
+    async def wrapper():
+        try:
+            await coro
+        finally:
+            await db.engine.dispose()
+    asyncio.run(wrapper())
+
+
+async def eventually(condition, timeout: float = 2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+
+def test_fsm_state_is_shared_between_dispatchers():
+    async def check():
+        server = fakeredis.FakeServer()
+        first = Dispatcher(storage=RedisStorage(fakeredis.aioredis.FakeRedis(server=server)))
+        second = Dispatcher(storage=RedisStorage(fakeredis.aioredis.FakeRedis(server=server)))
+        bot = Bot(token="123456:TEST")
+        try:
+            await first.fsm.get_context(bot, chat_id=1, user_id=1).set_state("AdminStates:waiting_for_mute_time")
+            await first.fsm.get_context(bot, chat_id=1, user_id=1).update_data(target=42)
+            context = second.fsm.get_context(bot, chat_id=1, user_id=1)
+            assert await context.get_state() == "AdminStates:waiting_for_mute_time"
+            assert await context.get_data() == {"target": 42}
+        finally:
+            await bot.session.close()
+    run(check())
+
+
+def test_moderation_changes_reach_other_instances():
+    async def check():
+        server = fakeredis.FakeServer()
+        sender = InvalidationBus(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        receiver = InvalidationBus(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        listener = asyncio.create_task(receiver.run())
+        try:
+            await asyncio.sleep(0.1)  # subscribed
+            until = datetime.utcnow() + timedelta(hours=1)
+            sender.publish("ban", 9001)
+            sender.publish_many("ban", [9002, 9003])
+            sender.publish("mute", 9004, until)
+            await eventually(lambda: {9001, 9002, 9003} <= BANNED_USERS and get_mute(9004) == until)
+            assert stats.muted_users.get(9004) == until
+
+            sender.publish("unban", 9001)
+            sender.publish("unmute", 9004)
+            await eventually(lambda: 9001 not in BANNED_USERS and get_mute(9004) is None)
+            assert 9004 not in stats.muted_users
+        finally:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+    run(check())
+
+
+def test_mute_expiry_clears_instances_that_lost_the_update():
+    async def check():
+        await db.init_db()
+        until = datetime.utcnow() - timedelta(seconds=1)
+        # Another instance already cleared the row
+        async with AsyncSessionLocal() as session:
+            session.add(User(user_id=9100, first_name="A", mute_until=None))
+            await session.commit()
+        stats.user_muted(9100, until)
+        set_mute(9100, until)
+
+        scheduler = MuteExpiryScheduler()
+        scheduler.schedule(9100, until)
+        due = scheduler._pop_due(datetime.utcnow())
+        await scheduler._expire(datetime.utcnow(), [user_id for _, user_id in due])
+        assert 9100 not in stats.muted_users
+        assert get_mute(9100) in (None, MUTE_UNKNOWN)
+    run(check())
@@ -0,0 +1,66 @@
+import asyncio
+from aiogram.types import (
+    Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+)
+
+# Telegram delivers every item of an album (media group) as its own update.
+# Items are collected per media_group_id until no new item arrived for
+# `window` seconds, then the whole album is handed over at once.
+
+
+class AlbumCollector:
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._groups = {}  # media_group_id -> [messages, on_complete, timer]
+        self._pending = set()
+
+    def add(self, message: Message, on_complete):
+        """on_complete(messages) is awaited once with the whole album, in order."""
+        loop = asyncio.get_running_loop()
+        group = self._groups.get(message.media_group_id)
+        if group is None:
+            group = self._groups[message.media_group_id] = [[], on_complete, None]
+        else:
+            group[2].cancel()
+        group[0].append(message)
+        group[2] = loop.call_later(self.window, self._complete, message.media_group_id)
+
+    def _complete(self, group_id: str):
+        messages, on_complete, _ = self._groups.pop(group_id)
+        task = asyncio.create_task(self._run(on_complete, messages))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _run(self, on_complete, messages: list):
+        try:
+            await on_complete(sorted(messages, key=lambda m: m.message_id))
+        except Exception as e:
+            print(f"Error in background task: {e}")
+
+    async def flush(self):
+        """Hands over albums still being collected (on shutdown)."""
+        for group_id in list(self._groups):
+            self._groups[group_id][2].cancel()
+            self._complete(group_id)
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+def input_media(message: Message, caption: str = None, parse_mode: str = None):
+    """InputMedia for one album item. caption=None keeps the item's own caption."""
+    if caption is None:
+        kwargs = {"caption": message.caption, "caption_entities": message.caption_entities}
+    else:
+        kwargs = {"caption": caption, "parse_mode": parse_mode}
+    if message.photo:
+        return InputMediaPhoto(media=message.photo[-1].file_id, **kwargs)
+    if message.video:
+        return InputMediaVideo(media=message.video.file_id, **kwargs)
+    if message.document:
+        return InputMediaDocument(media=message.document.file_id, **kwargs)
+    if message.audio:
+        return InputMediaAudio(media=message.audio.file_id, **kwargs)
+    return None
+
+
+albums = AlbumCollector()
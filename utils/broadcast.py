@@ -0,0 +1,187 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from config import BROADCAST_RATE, BROADCAST_CHUNK
+from database.db import (
+    AsyncSessionLocal, iter_broadcast_recipients, save_broadcast_progress, get_running_broadcasts,
+    get_broadcast, claim_broadcast, cancel_broadcast
+)
+from database.models import Broadcast
+from keyboards.admin_kb import broadcast_progress_kb
+from utils.delivery import delivery, RateLimiter
+from utils.shared_state import bus
+
+# Broadcast to every user. Recipients are read in user_id order, sent through
+# the delivery engine (global Telegram limits, RetryAfter, retries). The cursor
+# is checkpointed before a chunk is sent: after a crash the rest of that chunk
+# is skipped rather than sent twice. Only the instance holding the lease runs a
+# broadcast, it is renewed on every checkpoint and taken over once it expires.
+# BROADCAST_RATE stays below the global limit to leave room for normal replies.
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class Broadcaster:
+    def __init__(self, rate: float = 25, chunk_size: int = 50, progress_interval: float = 5,
+                 lease: float = 300):
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.lease = timedelta(seconds=lease)
+        self._limiter = RateLimiter(rate)
+        self._running = {}  # broadcast id -> task
+        self._stopping = False
+        self._stopped = asyncio.Event()
+
+    def start(self, bot: Bot, broadcast: Broadcast):
+        task = asyncio.create_task(self._run(bot, broadcast))
+        self._running[broadcast.id] = task
+        task.add_done_callback(lambda _: self._running.pop(broadcast.id, None))
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        # Stored in the broadcast: whichever instance holds the lease stops
+        async with AsyncSessionLocal() as session:
+            return await cancel_broadcast(session, broadcast_id)
+
+    async def resume_all(self, bot: Bot):
+        async with AsyncSessionLocal() as session:
+            broadcasts = await get_running_broadcasts(session)
+        for broadcast in broadcasts:
+            # Started everywhere, the instance that gets the lease sends it
+            self.start(bot, broadcast)
+
+    async def _claim(self, broadcast: Broadcast):
+        """
+        Waits for the lease: another instance may be running the broadcast or
+        have died while running it. Returns its fresh state, None once it is over.
+        """
+        while not self._stopping:
+            async with AsyncSessionLocal() as session:
+                claimed = await claim_broadcast(session, broadcast, bus.instance_id, self.lease)
+                current = await get_broadcast(session, broadcast.id)
+            if current is None or current.status != "running":
+                return None
+            if claimed:
+                return current
+            wait = max(1.0, (current.lease_until - datetime.utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(self._stopped.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _checkpoint(self, broadcast: Broadcast, blocked_ids: list = ()) -> bool:
+        async with AsyncSessionLocal() as session:
+            return await save_broadcast_progress(session, broadcast, blocked_ids, self.lease)
+
+    async def _send(self, bot: Bot, broadcast: Broadcast, user_id: int):
+        await self._limiter.acquire()
+        return await delivery.send(
+            user_id, lambda: bot.copy_message(user_id, broadcast.from_chat_id, broadcast.message_id)
+        )
+
+    def _progress_text(self, broadcast: Broadcast, speed: float) -> str:
+        done = broadcast.sent + broadcast.failed + broadcast.blocked
+        text = (
+            f"📢 **Рассылка #{broadcast.id}**\n\n"
+            f"📨 Обработано: `{done}` / `{broadcast.total}`\n"
+            f"✅ Доставлено: `{broadcast.sent}`\n"
+            f"⛔ Заблокировали бота: `{broadcast.blocked}`\n"
+            f"⚠️ Ошибок: `{broadcast.failed}`\n"
+        )
+        if broadcast.status == "running":
+            eta = _format_eta(max(0, broadcast.total - done) / speed) if speed else "—"
+            text += f"⏱ Осталось: ~{eta}"
+        elif broadcast.status == "cancelled":
+            text += "🛑 Остановлена"
+        else:
+            text += "🏁 Завершена"
+        return text
+
+    async def _show_progress(self, bot: Bot, broadcast: Broadcast, speed: float):
+        if not broadcast.progress_message_id:
+            return
+        try:
+            await bot.edit_message_text(
+                self._progress_text(broadcast, speed),
+                chat_id=broadcast.admin_chat_id,
+                message_id=broadcast.progress_message_id,
+                reply_markup=broadcast_progress_kb(broadcast.id) if broadcast.status == "running" else None,
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            # "message is not modified" and the like must not stop the broadcast
+            logging.debug(f"Broadcast progress not updated: {e}")
+
+    async def _run(self, bot: Bot, broadcast: Broadcast):
+        broadcast = await self._claim(broadcast)
+        if broadcast is None:
+            return
+        if broadcast.last_user_id:
+            print(f"✅ Resuming broadcast #{broadcast.id} after user {broadcast.last_user_id}")
+        loop = asyncio.get_running_loop()
+        started = last_shown = loop.time()
+        done_before = broadcast.sent + broadcast.failed + broadcast.blocked
+        try:
+            async for chunk in iter_broadcast_recipients(broadcast.last_user_id, self.chunk_size):
+                if self._stopping:
+                    # Shutdown: stays "running" and resumes from this checkpoint
+                    return
+                broadcast.last_user_id = chunk[-1]
+                if not await self._checkpoint(broadcast):
+                    # Another instance took the lease over
+                    return
+                if broadcast.status == "cancelled":
+                    break
+                results = await asyncio.gather(*(self._send(bot, broadcast, user_id) for user_id in chunk))
+                blocked_ids = []
+                for result in results:
+                    if result.ok:
+                        broadcast.sent += 1
+                    elif isinstance(result.error, TelegramForbiddenError):
+                        blocked_ids.append(result.chat_id)
+                    else:
+                        broadcast.failed += 1
+                broadcast.blocked += len(blocked_ids)
+                if not await self._checkpoint(broadcast, blocked_ids):
+                    return
+                if broadcast.status == "cancelled":
+                    break
+
+                now = loop.time()
+                if now - last_shown >= self.progress_interval:
+                    last_shown = now
+                    done = broadcast.sent + broadcast.failed + broadcast.blocked - done_before
+                    await self._show_progress(bot, broadcast, done / (now - started))
+            else:
+                broadcast.status = "done"
+        except asyncio.CancelledError:
+            # The rest of the chunk in flight is skipped on resume
+            raise
+        except Exception:
+            logging.exception(f"Broadcast #{broadcast.id} failed")
+            return
+
+        broadcast.finished_at = datetime.utcnow()
+        if await self._checkpoint(broadcast):
+            await self._show_progress(bot, broadcast, 0)
+
+    async def stop(self, timeout: float = 10):
+        # Let running broadcasts finish and checkpoint the current chunk
+        self._stopping = True
+        self._stopped.set()
+        tasks = list(self._running.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+broadcaster = Broadcaster(rate=BROADCAST_RATE, chunk_size=BROADCAST_CHUNK)
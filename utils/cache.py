@@ -1,5 +1,8 @@
 # Simple in-memory storage for banned users to avoid circular imports and DB hits
 # This set should be populated on startup and updated on ban/unban
+import hashlib
+from datetime import datetime
+from cachetools import LRUCache
 
 BANNED_USERS = set()
 
@@ -8,6 +11,92 @@ def is_banned(user_id: int) -> bool:
 
 def add_ban(user_id: int):
     BANNED_USERS.add(user_id)
+    invalidate_profile(user_id)
 
 def remove_ban(user_id: int):
     BANNED_USERS.discard(user_id)
+    invalidate_profile(user_id)
+
+def add_bans(user_ids):
+    BANNED_USERS.update(user_ids)
+    for user_id in user_ids:
+        invalidate_profile(user_id)
+
+def remove_bans(user_ids):
+    BANNED_USERS.difference_update(user_ids)
+    for user_id in user_ids:
+        invalidate_profile(user_id)
+
+# Users a broadcast found to have blocked the bot, they are back in
+# broadcasts as soon as they write to the bot again
+BLOCKED_USERS = set()
+
+# Mute state: user_id -> mute_until, or None for "known not muted".
+# Warmed with every active mute on startup. Bounded LRU: a miss only costs
+# one DB lookup in BanMuteMiddleware, so evicting entries is always safe.
+MUTE_UNKNOWN = object()
+MUTE_CACHE = LRUCache(maxsize=100000)
+# Muted users who were already told "You are muted"
+MUTE_NOTIFIED = set()
+
+def get_mute(user_id: int):
+    return MUTE_CACHE.get(user_id, MUTE_UNKNOWN)
+
+def set_mute(user_id: int, until):
+    MUTE_CACHE[user_id] = until
+    MUTE_NOTIFIED.discard(user_id)
+    invalidate_profile(user_id)
+
+def clear_mute(user_id: int):
+    set_mute(user_id, None)
+
+def mark_mute_notified(user_id: int) -> bool:
+    """Returns True only the first time for the current mute."""
+    if user_id in MUTE_NOTIFIED:
+        return False
+    MUTE_NOTIFIED.add(user_id)
+    return True
+
+# Reply routing: (admin_chat_id, message_id) -> user_id.
+# Front of the message_routes table, recent messages are what admins reply to.
+ROUTE_CACHE = LRUCache(maxsize=50000)
+
+def remember_route(admin_chat_id: int, message_id: int, user_id: int):
+    ROUTE_CACHE[(admin_chat_id, message_id)] = user_id
+
+def get_cached_route(admin_chat_id: int, message_id: int):
+    return ROUTE_CACHE.get((admin_chat_id, message_id))
+
+# /find queries by short token, callback data is limited to 64 bytes.
+# token -> [query, total matches]
+SEARCH_CACHE = LRUCache(maxsize=1000)
+
+def remember_search(query: str, total: int) -> str:
+    token = hashlib.sha1(query.lower().encode()).hexdigest()[:10]
+    SEARCH_CACHE[token] = [query, total]
+    return token
+
+def get_search(token: str):
+    return SEARCH_CACHE.get(token)
+
+# Rendered admin profile cards: user_id -> (card, expires).
+# Every ban/mute change goes through the helpers above, which drop the card,
+# so local actions, other instances (bus) and mute expiry are all covered.
+# A muted card also expires by itself when the mute ends.
+PROFILE_CACHE = LRUCache(maxsize=10000)
+
+def get_profile_card(user_id: int):
+    entry = PROFILE_CACHE.get(user_id)
+    if entry is None:
+        return None
+    card, expires = entry
+    if expires and expires <= datetime.utcnow():
+        invalidate_profile(user_id)
+        return None
+    return card
+
+def set_profile_card(user_id: int, card, expires: datetime = None):
+    PROFILE_CACHE[user_id] = (card, expires)
+
+def invalidate_profile(user_id: int):
+    PROFILE_CACHE.pop(user_id, None)
@@ -0,0 +1,101 @@
+import asyncio
+from dataclasses import dataclass
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from config import SEND_RATE_GLOBAL, SEND_RATE_PER_CHAT, SEND_CONCURRENCY, SEND_MAX_RETRIES
+
+# Central outbound delivery for Bot API sends.
+# Sends run concurrently but are spaced to Telegram's limits
+# (~30 msg/s overall, ~1 msg/s per chat), honour RetryAfter and
+# retry transient network/server errors with backoff.
+
+@dataclass
+class DeliveryResult:
+    chat_id: int
+    ok: bool
+    result: object = None  # Message / MessageId returned by the API
+    error: Exception = None
+
+
+class RateLimiter:
+    """Spaces acquisitions at least 1/rate seconds apart."""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        now = asyncio.get_running_loop().time()
+        self._next = max(self._next, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self._next < now
+
+
+class DeliveryEngine:
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1,
+                 concurrency: int = 8, max_retries: int = 3):
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._global = RateLimiter(global_rate)
+        self._chats = {}  # chat_id -> RateLimiter
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _chat_limiter(self, chat_id: int) -> RateLimiter:
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            if len(self._chats) > 10000:
+                now = asyncio.get_running_loop().time()
+                self._chats = {cid: lim for cid, lim in self._chats.items() if not lim.idle(now)}
+            limiter = self._chats[chat_id] = RateLimiter(self.per_chat_rate)
+        return limiter
+
+    async def send(self, chat_id: int, call) -> DeliveryResult:
+        """
+        call: zero-argument callable returning the API call to await,
+        e.g. lambda: bot.send_message(chat_id, text). It is invoked again on retry.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            # This chat's turn comes first: a slow or rate-limited chat waits
+            # without holding one of the global slots other chats need
+            await self._chat_limiter(chat_id).acquire()
+            async with self._semaphore:
+                await self._global.acquire()
+                try:
+                    return DeliveryResult(chat_id, True, result=await call())
+                except TelegramRetryAfter as e:
+                    # Flood limit: hold back this chat and everything else for retry_after
+                    error = e
+                    self._chat_limiter(chat_id).pause(e.retry_after)
+                    self._global.pause(e.retry_after)
+                    continue
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    error = e
+                except Exception as e:
+                    # Blocked, bad request, etc. Retrying will not help.
+                    return DeliveryResult(chat_id, False, error=e)
+            # Backoff outside the slot as well
+            if attempt < self.max_retries:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        return DeliveryResult(chat_id, False, error=error)
+
+    async def fan_out(self, chat_ids, make_call) -> list:
+        """Sends to several chats at once. make_call(chat_id) returns the API call."""
+        return await asyncio.gather(
+            *(self.send(chat_id, lambda chat_id=chat_id: make_call(chat_id)) for chat_id in chat_ids)
+        )
+
+
+delivery = DeliveryEngine(
+    global_rate=SEND_RATE_GLOBAL,
+    per_chat_rate=SEND_RATE_PER_CHAT,
+    concurrency=SEND_CONCURRENCY,
+    max_retries=SEND_MAX_RETRIES,
+)
@@ -0,0 +1,183 @@
+import logging
+import re
+import time
+from collections import deque
+from aiogram import Bot
+from config import DIGEST_INTERVAL, DIGEST_MAX_ITEMS, DIGEST_BUSY_RATE
+from database.db import AsyncSessionLocal, get_digest_admins, set_digest, add_message_routes
+from utils.delivery import delivery
+from utils.tasks import BatchWriter
+from utils.shared_state import bus
+
+# Digest mode: admins who opted in (/digest on) get text feedback combined
+# into one message every `interval` seconds or every `max_items` items, but
+# only while traffic is high (`busy_rate` messages a minute or more). Once it
+# drops below half of that, pending items go out and delivery is immediate
+# again. Every item keeps its "📩 <id>" header: a digest from a single user is
+# routed like a normal message, in a mixed one the admin quotes the part they
+# answer (see header_user).
+# A digest that cannot be delivered goes back to the queue for the next
+# round; after MAX_ATTEMPTS (or on shutdown) its items are sent one by one.
+
+MAX_TEXT = 4096
+MAX_ATTEMPTS = 3
+HEADER = re.compile(r"📩\s*(\d+)")
+
+
+def header_user(text: str, quote=None):
+    """
+    User a reply is meant for, from the "📩 <id>" headers of the replied message:
+    the only one there, or the one the quoted part belongs to. None if unclear.
+    """
+    headers = [(match.start(), int(match.group(1))) for match in HEADER.finditer(text)]
+    if len({user_id for _, user_id in headers}) <= 1:
+        return headers[0][1] if headers else None
+    if quote is None:
+        return None
+    # quote.position counts UTF-16 code units
+    start = len(text.encode("utf-16-le")[:quote.position * 2].decode("utf-16-le", errors="ignore"))
+    before = [user_id for offset, user_id in headers if offset <= start]
+    return before[-1] if before else headers[0][1]
+
+
+class DigestQueue(BatchWriter):
+    def __init__(self, interval: float = 30, max_items: int = 20, busy_rate: int = 30):
+        super().__init__()
+        self.interval = interval
+        self.max_items = max_items
+        self.busy_rate = busy_rate
+        self.admins = set()  # opted in
+        self.busy = False
+        self.bot = None
+        self._recent = deque()  # arrival times of feedback in the last minute
+        self._items = {}  # admin_id -> [(user_id, text, attempts)]
+        self._deadlines = {}  # admin_id -> when the pending digest is due
+
+    async def load(self, bot: Bot):
+        self.bot = bot
+        async with AsyncSessionLocal() as session:
+            self.admins = set(await get_digest_admins(session))
+
+    async def set_enabled(self, admin_id: int, enabled: bool):
+        async with AsyncSessionLocal() as session:
+            await set_digest(session, admin_id, enabled)
+        self.apply(admin_id, enabled)
+        bus.publish("digest_on" if enabled else "digest_off", admin_id)
+
+    def apply(self, admin_id: int, enabled: bool):
+        if enabled:
+            self.admins.add(admin_id)
+        else:
+            self.admins.discard(admin_id)
+            if admin_id in self._deadlines:
+                # What is pending goes out now
+                self._deadlines[admin_id] = 0
+                self.wake()
+
+    def _track(self, now: float):
+        self._recent.append(now)
+        while now - self._recent[0] > 60:
+            self._recent.popleft()
+        rate = len(self._recent)
+        if not self.busy and rate >= self.busy_rate:
+            self.busy = True
+        elif self.busy and rate < self.busy_rate / 2:
+            self.busy = False
+            self.wake()
+
+    def route(self, user_id: int, text: str, admin_ids) -> list:
+        """
+        Called for every feedback message. Returns the admins that took it into
+        their digest, the rest get it right away. text=None for content that is
+        always delivered at once (media).
+        """
+        now = time.monotonic()
+        self._track(now)
+        if not self.busy or text is None:
+            return []
+        queued = []
+        for admin_id in admin_ids:
+            if admin_id not in self.admins:
+                continue
+            items = self._items.setdefault(admin_id, [])
+            items.append((user_id, text, 0))
+            if len(items) == 1:
+                self._deadlines[admin_id] = now + self.interval
+                self.wake()
+            if len(items) >= self.max_items:
+                self._deadlines[admin_id] = now
+                self.wake()
+            queued.append(admin_id)
+        return queued
+
+    def _chunks(self, items: list):
+        chunk, size = [], 0
+        for user_id, text, attempts in items:
+            text = text[:MAX_TEXT - 100]
+            if chunk and size + len(text) + 2 > MAX_TEXT - 100:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((user_id, text, attempts))
+            size += len(text) + 2
+        if chunk:
+            yield chunk
+
+    async def _send_text(self, admin_id: int, text: str):
+        result = await delivery.send(admin_id, lambda: self.bot.send_message(admin_id, text, parse_mode="Markdown"))
+        if not result.ok and "parse entities" in str(result.error):
+            # One broken message must not hold back the rest
+            result = await delivery.send(admin_id, lambda: self.bot.send_message(admin_id, text.replace("`", "")))
+        if not result.ok:
+            logging.error(f"Digest to admin {admin_id} failed: {result.error}")
+        return result
+
+    async def send(self, admin_id: int):
+        items = self._items.pop(admin_id, [])
+        self._deadlines.pop(admin_id, None)
+        routes = []
+        failed = []
+        for chunk in self._chunks(items):
+            text = f"🗂 Дайджест: {len(chunk)}\n\n" + "\n\n".join(item for _, item, _ in chunk)
+            result = await self._send_text(admin_id, text)
+            if not result.ok:
+                failed.extend(chunk)
+                continue
+            users = {user_id for user_id, _, _ in chunk}
+            if len(users) == 1:
+                routes.append((admin_id, result.result.message_id, users.pop()))
+
+        retry = [(user_id, text, attempts + 1) for user_id, text, attempts in failed
+                 if attempts + 1 < MAX_ATTEMPTS and not self.stopping]
+        if retry:
+            # Back in front of the queue, tried again with the next digest
+            self._items[admin_id] = retry + self._items.get(admin_id, [])
+            self._deadlines.setdefault(admin_id, time.monotonic() + self.interval)
+        for user_id, text, attempts in failed:
+            if attempts + 1 >= MAX_ATTEMPTS or self.stopping:
+                result = await self._send_text(admin_id, text)
+                if result.ok:
+                    routes.append((admin_id, result.result.message_id, user_id))
+        if routes:
+            async with AsyncSessionLocal() as session:
+                await add_message_routes(session, routes)
+
+    def timeout(self):
+        if not self._deadlines:
+            return None
+        return max(0, min(self._deadlines.values()) - time.monotonic())
+
+    async def flush(self):
+        """Sends the digests that are due, every pending one once stopping."""
+        if self.bot is None:
+            return
+        now = time.monotonic()
+        due = [admin_id for admin_id, deadline in self._deadlines.items()
+               if deadline <= now or not self.busy or self.stopping]
+        for admin_id in due:
+            try:
+                await self.send(admin_id)
+            except Exception:
+                logging.exception(f"Digest to admin {admin_id} failed")
+
+
+digests = DigestQueue(interval=DIGEST_INTERVAL, max_items=DIGEST_MAX_ITEMS, busy_rate=DIGEST_BUSY_RATE)
@@ -0,0 +1,121 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime
+from aiogram import Bot
+from aiogram.types import InputFile
+from sqlalchemy import select
+from database.db import AsyncSessionLocal, User
+from utils.delivery import delivery
+
+# /export: the users table is read with a server-side cursor in chunks,
+# every chunk is encoded (and compressed) in a worker thread and appended to
+# a spooled temp file, so memory stays flat and the event loop keeps serving
+# updates. The file is then uploaded in chunks from disk.
+
+COLUMNS = ["user_id", "first_name", "username", "joined_at", "is_banned", "mute_until", "blocked_at"]
+FORMATS = ("csv", "jsonl")
+CHUNK_ROWS = 500
+SPOOL_SIZE = 8 * 1024 * 1024  # bigger exports go to a real temp file
+MAX_UPLOAD = 50 * 1024 * 1024  # Bot API document limit
+
+
+def _value(value):
+    return value.isoformat(sep=" ") if isinstance(value, datetime) else value
+
+
+def encode_rows(rows: list, fmt: str, header: bool = False) -> bytes:
+    if fmt == "jsonl":
+        return "".join(
+            json.dumps({column: _value(value) for column, value in zip(COLUMNS, row)}, ensure_ascii=False) + "\n"
+            for row in rows
+        ).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows([_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+class SpooledInputFile(InputFile):
+    """Uploads an open binary file in chunks. Rewinds on every read, so retries resend it whole."""
+    def __init__(self, file, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot):
+        await asyncio.to_thread(self.file.seek, 0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+async def export_users(fmt: str = "csv", compress: bool = False):
+    """Returns (spooled file, row count). The caller closes the file."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    sink = gzip.GzipFile(fileobj=out, mode="wb") if compress else out
+    columns = [getattr(User, column) for column in COLUMNS]
+    count = 0
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(
+            select(*columns).order_by(User.user_id).execution_options(yield_per=CHUNK_ROWS)
+        )
+        async for partition in result.partitions():
+            rows = [tuple(row) for row in partition]
+            data = await asyncio.to_thread(encode_rows, rows, fmt, count == 0)
+            await asyncio.to_thread(sink.write, data)
+            count += len(rows)
+    if count == 0 and fmt == "csv":
+        sink.write(encode_rows([], fmt, header=True))
+    if compress:
+        await asyncio.to_thread(sink.close)
+    return out, count
+
+
+async def send_export(bot: Bot, chat_id: int, fmt: str, compress: bool):
+    started = datetime.utcnow()
+    out, count = await export_users(fmt, compress)
+    try:
+        size = out.tell()
+        if size > MAX_UPLOAD:
+            hint = "" if compress else " Попробуйте /export " + fmt + " gz"
+            await bot.send_message(chat_id, f"❌ Экспорт занимает {size // (1024 * 1024)} МБ, больше лимита Telegram (50 МБ).{hint}")
+            return
+        filename = f"users-{started:%Y%m%d-%H%M}.{fmt}" + (".gz" if compress else "")
+        seconds = (datetime.utcnow() - started).total_seconds()
+        document = SpooledInputFile(out, filename)
+        result = await delivery.send(chat_id, lambda: bot.send_document(
+            chat_id, document, caption=f"📦 Пользователей: {count} ({seconds:.1f} с)"
+        ))
+        if not result.ok:
+            await bot.send_message(chat_id, f"Ошибка отправки: {result.error}")
+    finally:
+        out.close()
+
+
+class ExportRunner:
+    """Exports run as background tasks, one at a time."""
+    def __init__(self):
+        self.task = None
+
+    def start(self, bot: Bot, chat_id: int, fmt: str, compress: bool) -> bool:
+        if self.task and not self.task.done():
+            return False
+        self.task = asyncio.create_task(self._run(bot, chat_id, fmt, compress))
+        return True
+
+    async def _run(self, bot: Bot, chat_id: int, fmt: str, compress: bool):
+        try:
+            await send_export(bot, chat_id, fmt, compress)
+        except Exception as e:
+            print(f"Error in background task: {e}")
+            try:
+                await bot.send_message(chat_id, f"❌ Экспорт не удался: {e}")
+            except Exception:
+                pass
+
+
+exporter = ExportRunner()
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from aiogram.types import Message
+from config import DEDUP_WINDOW, DEDUP_MIN_LENGTH
+
+# Content fingerprints for collapsing repeated feedback (spam waves).
+# - exact: hash of the normalized text, or of file_unique_id + caption for media
+# - near: 64-bit SimHash over character 4-grams, looked up through LSH bands:
+#   with 8 bands of 8 bits, two hashes within 7 bits of each other share
+#   at least one band, so only the entries of matching bands are compared.
+# Short texts ("привет") are only collapsed for the same user, different
+# people writing the same short message is normal.
+
+BANDS = 8
+BAND_BITS = 64 // BANDS
+SHINGLE = 4
+MAX_SHINGLES = 4096
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+# SimHash bit counting with plain int arithmetic: each byte of the shingle hash
+# has its own accumulator of 8 packed 16-bit counters, _SPREAD[byte] puts every
+# bit of the byte into its counter
+_LANE = 16
+_LANE_MASK = (1 << _LANE) - 1
+_SPREAD = [sum(1 << (bit * _LANE) for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def simhash(text: str) -> int:
+    shingles = {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+    if len(shingles) > MAX_SHINGLES:
+        shingles = set(list(shingles)[:MAX_SHINGLES])
+    spread = _SPREAD
+    c0 = c1 = c2 = c3 = c4 = c5 = c6 = c7 = 0
+    for shingle in shingles:
+        # hash() is randomized per process, fine for an in-memory index
+        value = hash(shingle)
+        c0 += spread[value & 255]
+        c1 += spread[value >> 8 & 255]
+        c2 += spread[value >> 16 & 255]
+        c3 += spread[value >> 24 & 255]
+        c4 += spread[value >> 32 & 255]
+        c5 += spread[value >> 40 & 255]
+        c6 += spread[value >> 48 & 255]
+        c7 += spread[value >> 56 & 255]
+    threshold = len(shingles) / 2
+    result = 0
+    for byte, counters in enumerate((c0, c1, c2, c3, c4, c5, c6, c7)):
+        for bit in range(8):
+            if counters >> (bit * _LANE) & _LANE_MASK > threshold:
+                result |= 1 << (byte * 8 + bit)
+    return result
+
+
+def _bands(value: int) -> list:
+    return [(band, value >> (band * BAND_BITS) & ((1 << BAND_BITS) - 1)) for band in range(BANDS)]
+
+
+def _file_unique_id(message: Message):
+    media = (message.photo[-1] if message.photo else None) or message.video or message.document \
+        or message.voice or message.audio or message.animation or message.sticker or message.video_note
+    return media.file_unique_id if media else None
+
+
+@dataclass
+class Fingerprint:
+    exact: str
+    simhash: int = None  # None for media and short texts
+
+
+@dataclass
+class DuplicateEntry:
+    fingerprint: Fingerprint
+    user_id: int
+    created_at: float
+    routes: list = field(default_factory=list)  # [(admin_chat_id, message_id)] of the original
+    sent_text: str = None  # what admins received, repeated edits are built on it
+    is_caption: bool = False
+    queued: list = field(default_factory=list)  # digest admins, nothing to edit for them yet
+    repeats: int = 0
+    users: set = field(default_factory=set)
+    # Set once the original was delivered or failed (and the entry removed),
+    # copies arriving meanwhile wait for it
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class FingerprintIndex:
+    def __init__(self, window: float = 600, max_entries: int = 10000,
+                 max_distance: int = 6, min_length: int = 20):
+        self.window = window
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self._entries = OrderedDict()  # exact key -> entry, oldest first
+        self._bands = {}  # (band, value) -> set of exact keys
+
+    def fingerprint(self, message: Message, user_id: int):
+        """None for content that is never collapsed."""
+        if self.window <= 0:
+            return None
+        text = normalize(message.text or message.caption or "")
+        file_id = _file_unique_id(message)
+        if file_id:
+            digest = hashlib.sha1(f"{file_id}\0{text}".encode()).hexdigest()
+            return Fingerprint(f"m:{digest}")
+        if not text:
+            return None
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        if len(text) < self.min_length:
+            return Fingerprint(f"u:{user_id}:{digest}")
+        return Fingerprint(f"t:{digest}", simhash(text))
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry.created_at < self.window:
+                break
+            self.remove(entry)
+
+    def match(self, fingerprint: Fingerprint):
+        """The live entry for the same or a near-identical content, if any."""
+        self._evict(time.monotonic())
+        entry = self._entries.get(fingerprint.exact)
+        if entry or fingerprint.simhash is None:
+            return entry
+        for band in _bands(fingerprint.simhash):
+            for key in self._bands.get(band, ()):
+                candidate = self._entries[key]
+                if (candidate.fingerprint.simhash ^ fingerprint.simhash).bit_count() <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint: Fingerprint, user_id: int) -> DuplicateEntry:
+        entry = DuplicateEntry(fingerprint, user_id, time.monotonic())
+        self._entries[fingerprint.exact] = entry
+        if fingerprint.simhash is not None:
+            for band in _bands(fingerprint.simhash):
+                self._bands.setdefault(band, set()).add(fingerprint.exact)
+        return entry
+
+    def remove(self, entry: DuplicateEntry):
+        if self._entries.get(entry.fingerprint.exact) is not entry:
+            return
+        del self._entries[entry.fingerprint.exact]
+        if entry.fingerprint.simhash is not None:
+            for band in _bands(entry.fingerprint.simhash):
+                keys = self._bands.get(band)
+                if keys:
+                    keys.discard(entry.fingerprint.exact)
+                    if not keys:
+                        del self._bands[band]
+
+
+duplicates = FingerprintIndex(window=DEDUP_WINDOW, min_length=DEDUP_MIN_LENGTH)
@@ -0,0 +1,63 @@
+from datetime import datetime
+from aiogram.types import Message
+from config import HISTORY_RETENTION_DAYS
+from database.db import AsyncSessionLocal, add_feedback_messages, prune_feedback_messages
+from utils.tasks import BatchWriter, Retention
+
+MAX_TEXT = 1000
+
+
+def describe(message: Message) -> tuple:
+    """(content_type, text) stored for a message, long texts are cut."""
+    text = message.text or message.caption
+    if text and len(text) > MAX_TEXT:
+        text = text[:MAX_TEXT] + "…"
+    return message.content_type, text
+
+
+class HistoryWriter(BatchWriter):
+    """
+    Write-behind conversation log, same idea as the registration buffer:
+    handlers only append to a list, one INSERT per batch every `flush_interval`
+    seconds. If the DB is unavailable for long, the oldest rows beyond
+    `max_pending` are dropped rather than growing memory.
+    """
+    def __init__(self, flush_interval: float = 1.0, max_batch: int = 500, max_pending: int = 20000,
+                 retention_days: int = 180, prune_interval: float = 3600):
+        super().__init__(flush_interval)
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.retention = Retention("History", prune_feedback_messages, retention_days, prune_interval)
+        self._pending = []
+
+    def record(self, user_id: int, direction: str, message: Message, admin_id: int = None):
+        content_type, text = describe(message)
+        self._pending.append({
+            "user_id": user_id,
+            "direction": direction,
+            "admin_id": admin_id,
+            "content_type": content_type,
+            "text": text,
+            "created_at": datetime.utcnow(),
+        })
+        if len(self._pending) > self.max_pending:
+            del self._pending[:len(self._pending) - self.max_pending]
+        if len(self._pending) >= self.max_batch:
+            self.wake()
+
+    async def flush(self):
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:len(batch)]
+            try:
+                async with AsyncSessionLocal() as session:
+                    await add_feedback_messages(session, batch)
+            except Exception:
+                # Keep them for the next flush
+                self._pending[:0] = batch
+                raise
+
+    async def run_retention(self):
+        await self.retention.run()
+
+history = HistoryWriter(retention_days=HISTORY_RETENTION_DAYS)
@@ -0,0 +1,203 @@
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import json
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from aiogram import Bot
+from database.db import AsyncSessionLocal, upsert_users
+from utils.export import COLUMNS
+from utils.shared_state import bus
+
+# Bulk import of users and ban lists (CSV or JSONL, optionally gzipped).
+# Accepts /export files, CSV with a header naming some of COLUMNS, or just
+# one user_id per line. The file is parsed as a stream in a worker thread,
+# batch_size rows at a time, and each batch is one executemany upsert in its
+# own transaction. Values missing in the file keep what is already stored.
+# Ban/mute caches and counters are not touched here: the bot reloads them
+# after /import, import_users.py asks the running instances to do it over
+# the Redis bus.
+
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+FALSE_VALUES = {"0", "false", "no", "n", "f"}
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    rejected: int = 0
+    rejected_lines: list = field(default_factory=list)  # first few, for the report
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        text = (
+            f"✅ Импорт: {self.rows} строк за {self.seconds:.1f} с ({self.rate:.0f} строк/с)\n"
+            f"⚠️ Отклонено: {self.rejected}"
+        )
+        if self.rejected_lines:
+            text += f" (строки {', '.join(str(line) for line in self.rejected_lines)}"
+            text += ", …)" if self.rejected > len(self.rejected_lines) else ")"
+        return text
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _datetime(value):
+    value = _text(value)
+    if value is None:
+        return None
+    # Stored the way SQLAlchemy writes DateTime on SQLite
+    return datetime.fromisoformat(value.replace("Z", "")).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    value = str(value).strip().lower()
+    if not value:
+        return None
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+
+def normalize(record: dict, ban: bool, now: str) -> dict:
+    """Raises ValueError/TypeError for rows that cannot be imported."""
+    user_id = int(str(record["user_id"]).strip())
+    if user_id <= 0:
+        raise ValueError("user_id must be positive")
+    username = _text(record.get("username"))
+    return {
+        "user_id": user_id,
+        "first_name": _text(record.get("first_name")),
+        "username": username.lstrip("@") if username else None,
+        "joined_at": _datetime(record.get("joined_at")) or now,
+        "is_banned": True if ban else _bool(record.get("is_banned")),
+        "mute_until": _datetime(record.get("mute_until")),
+    }
+
+
+class RowReader:
+    """Incremental parser, read_batch() runs in a worker thread."""
+    def __init__(self, file, ban: bool = False):
+        file.seek(0)
+        head = file.read(2)
+        file.seek(0)
+        if head == b"\x1f\x8b":
+            file = gzip.GzipFile(fileobj=file, mode="rb")
+        self.lines = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="")
+        self.ban = ban
+        self.now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+        self._records = self._parse()
+
+    def _parse(self):
+        """Yields (line number, dict or raw JSON line)."""
+        first = next((line for line in self.lines if line.strip()), None)
+        if first is None:
+            return
+        lines = itertools.chain([first], self.lines)
+        if first.lstrip().startswith("{"):
+            for line_no, line in enumerate(lines, 1):
+                if line.strip():
+                    yield line_no, line
+            return
+
+        # csv.reader keeps quoted fields with line breaks together
+        reader = csv.reader(lines)
+        columns = None
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if columns is None:
+                if not row[0].strip().isdigit():
+                    columns = [name.strip().lower() for name in row]
+                    if "user_id" not in columns:
+                        raise ValueError("в заголовке CSV нет колонки user_id")
+                    continue
+                columns = COLUMNS
+            yield reader.line_num, dict(zip(columns, row))
+
+    def read_batch(self, size: int, report: ImportReport):
+        """Up to `size` parsed rows, None once the file is exhausted."""
+        batch = []
+        seen = 0
+        for line_no, record in itertools.islice(self._records, size):
+            seen += 1
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                batch.append(normalize(record, self.ban, self.now))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                report.rejected += 1
+                if len(report.rejected_lines) < 10:
+                    report.rejected_lines.append(line_no)
+        return batch if seen else None
+
+
+async def import_users(file, ban: bool = False, batch_size: int = 5000) -> ImportReport:
+    """file: binary file object. The caller reloads caches and counters afterwards."""
+    report = ImportReport()
+    started = time.perf_counter()
+    reader = await asyncio.to_thread(RowReader, file, ban)
+    parse = lambda: asyncio.ensure_future(asyncio.to_thread(reader.read_batch, batch_size, report))
+    pending = parse()
+    try:
+        while (batch := await pending) is not None:
+            # The next batch is parsed while this one is written
+            pending = parse()
+            if batch:
+                async with AsyncSessionLocal() as session:
+                    await upsert_users(session, batch)
+            report.rows += len(batch)
+    finally:
+        pending.cancel()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+class ImportRunner:
+    """Imports from the admin panel run as background tasks, one at a time."""
+    MAX_DOWNLOAD = 20 * 1024 * 1024  # Bot API download limit
+
+    def __init__(self):
+        self.task = None
+
+    def start(self, bot: Bot, chat_id: int, document, ban: bool) -> bool:
+        if self.task and not self.task.done():
+            return False
+        self.task = asyncio.create_task(self._run(bot, chat_id, document, ban))
+        return True
+
+    async def _run(self, bot: Bot, chat_id: int, document, ban: bool):
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as data:
+                await bot.download(document, destination=data)
+                report = await import_users(data, ban=ban)
+            # Bans, mutes and counters in one pass, then the same on other instances
+            await bus.reload()
+            await bus.publish_now("reload")
+            await bot.send_message(chat_id, report.summary())
+        except Exception as e:
+            print(f"Error in background task: {e}")
+            try:
+                await bot.send_message(chat_id, f"❌ Импорт не удался: {e}")
+            except Exception:
+                pass
+
+
+importer = ImportRunner()
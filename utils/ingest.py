@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+from utils.metrics import LANE_WAIT_SECONDS, LANE_SECONDS, LANE_SLO
+
+# Update ingestion: webhook requests and long polling only enqueue updates,
+# a fixed pool of workers feeds them to the dispatcher.
+# Updates go to one of two lanes:
+# - admin: updates from ADMIN_IDS (the same check as IsAdmin). Every worker
+#   takes them first and `admin_workers` more workers serve only this lane,
+#   so moderation keeps working while users flood the bot. When it is full,
+#   the webhook answers 503 and the poller waits (backpressure).
+# - user: everything else, bounded and shed under load. When it is full the
+#   oldest user update is dropped to make room, rather than blocking the
+#   poller or answering 503 (Telegram would hold back admin updates behind
+#   it). User updates that waited longer than max_age are dropped too.
+# Per-lane latency is measured against the `slo` seconds (metrics below).
+
+
+class UpdateQueue:
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 8,
+                 maxsize: int = 1000, max_age: float = 60, admin_ids=(),
+                 admin_workers: int = 2, admin_maxsize: int = 100, slo: dict = None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.admin_workers = admin_workers
+        self.max_age = max_age
+        self.admin_ids = admin_ids
+        self.slo = slo or {"admin": 1, "user": 5}  # lane -> seconds from receipt to processed
+        self.queue = asyncio.Queue(maxsize=maxsize)  # user lane
+        self.admin_queue = asyncio.Queue(maxsize=admin_maxsize)
+        self._available = asyncio.Semaphore(0)  # queued updates, wakes the shared workers
+        self._tasks = []
+        self.busy = 0
+        self.admin_busy = 0
+        self.processed = 0
+        self.rejected = 0  # admin lane full
+        self.shed = 0  # user lane full or too old when dequeued
+        self.failed = 0
+
+    def lane(self, update: Update) -> str:
+        try:
+            user = getattr(update.event, "from_user", None)
+        except UpdateTypeLookupError:
+            return "user"
+        return "admin" if user and user.id in self.admin_ids else "user"
+
+    def submit(self, update: Update) -> bool:
+        """Non-blocking enqueue. Returns False if the admin lane is full."""
+        item = (time.monotonic(), update)
+        if self.lane(update) == "admin":
+            try:
+                self.admin_queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                return False
+            self._available.release()
+            return True
+        if self.queue.full():
+            # The oldest user update makes room, its permit is reused
+            enqueued_at, _ = self.queue.get_nowait()
+            self.queue.task_done()
+            self._shed("user", enqueued_at)
+        else:
+            self._available.release()
+        self.queue.put_nowait(item)
+        return True
+
+    async def put(self, update: Update):
+        """Enqueue for polling, waits for space in the admin lane only."""
+        if self.lane(update) == "admin":
+            await self.admin_queue.put((time.monotonic(), update))
+            self._available.release()
+        else:
+            self.submit(update)
+
+    def _shed(self, lane: str, enqueued_at: float):
+        # Dropped updates count against the lane objective too
+        self.shed += 1
+        LANE_SECONDS.observe(time.monotonic() - enqueued_at, lane)
+        LANE_SLO.inc(lane, "shed")
+
+    async def _process(self, lane: str, enqueued_at: float, update: Update):
+        waited = time.monotonic() - enqueued_at
+        LANE_WAIT_SECONDS.observe(waited, lane)
+        if lane == "user" and waited > self.max_age:
+            self._shed(lane, enqueued_at)
+            return
+        self.busy += 1
+        if lane == "admin":
+            self.admin_busy += 1
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.exception(f"Update {update.update_id} failed: {e}")
+        finally:
+            self.busy -= 1
+            if lane == "admin":
+                self.admin_busy -= 1
+            elapsed = time.monotonic() - enqueued_at
+            LANE_SECONDS.observe(elapsed, lane)
+            LANE_SLO.inc(lane, "met" if elapsed <= self.slo[lane] else "missed")
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            # Admin updates first. Both lanes can be empty when a reserved
+            # worker already took the update this permit was released for.
+            if not self.admin_queue.empty():
+                lane, queue = "admin", self.admin_queue
+            elif not self.queue.empty():
+                lane, queue = "user", self.queue
+            else:
+                continue
+            enqueued_at, update = queue.get_nowait()
+            try:
+                await self._process(lane, enqueued_at, update)
+            finally:
+                queue.task_done()
+
+    async def _admin_worker(self):
+        while True:
+            enqueued_at, update = await self.admin_queue.get()
+            try:
+                await self._process("admin", enqueued_at, update)
+            finally:
+                self.admin_queue.task_done()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks += [asyncio.create_task(self._admin_worker()) for _ in range(self.admin_workers)]
+
+    async def stop(self, timeout: float = 10):
+        # Let the workers finish what is already queued
+        try:
+            await asyncio.wait_for(asyncio.gather(self.admin_queue.join(), self.queue.join()), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Dropping {self.admin_queue.qsize() + self.queue.qsize()} queued updates on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> dict:
+        workers = self.workers + self.admin_workers
+        return {
+            "depth": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "admin_depth": self.admin_queue.qsize(),
+            "admin_capacity": self.admin_queue.maxsize,
+            "workers": workers,
+            "admin_workers": self.admin_workers,
+            "busy": self.busy,
+            "admin_busy": self.admin_busy,
+            "utilisation": round(self.busy / workers, 2) if workers else 0,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "failed": self.failed,
+        }
+
+    # --- Webhook ---
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        if not self.submit(update):
+            return web.Response(status=503, text="admin queue full")
+        return web.Response()
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        return web.json_response(self.snapshot())
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle_webhook)
+        app.router.add_get("/status", self.handle_status)
+
+    # --- Polling ---
+
+    async def poll(self, polling_timeout: int = 30):
+        allowed_updates = self.dispatcher.resolve_used_update_types()
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset, timeout=polling_timeout, allowed_updates=allowed_updates
+                )
+            except Exception as e:
+                logging.error(f"Polling error: {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self.put(update)
+
+    async def log_status(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            logging.info(f"Update queue: {self.snapshot()}")
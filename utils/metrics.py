@@ -0,0 +1,235 @@
+import asyncio
+import time
+from functools import wraps
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# Minimal Prometheus metrics (text exposition format 0.0.4), no extra dependency.
+# Served on /metrics of the webhook app, or by a small server in polling mode.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+        self._function = None
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_function(self, function):
+        # function() returns {labels tuple: running total}, read at scrape time
+        self._function = function
+
+    def render(self) -> list:
+        lines = super().render()
+        values = self._function() if self._function else self._values
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+        self._function = None
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, function):
+        # function() returns {labels tuple: value}, read at scrape time
+        self._function = function
+
+    def render(self) -> list:
+        lines = super().render()
+        values = self._function() if self._function else self._values
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> list:
+        lines = super().render()
+        for labels, state in self._values.items():
+            for bound, count in zip(self.buckets, state):
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- Metrics ---
+
+UPDATES = Counter("replyer_updates_total", "Updates processed by type", ("type",))
+UPDATE_SECONDS = Histogram("replyer_update_seconds", "Full update processing time", ("type",))
+MIDDLEWARE_SECONDS = Histogram("replyer_middleware_seconds", "Time spent in a middleware itself", ("middleware",))
+HANDLER_SECONDS = Histogram("replyer_handler_seconds", "Handler execution time", ("handler",))
+DROPPED = Counter("replyer_dropped_total", "Messages stopped by middlewares", ("reason",))
+DB_SECONDS = Histogram("replyer_db_seconds", "DB helper execution time", ("query",))
+API_SECONDS = Histogram("replyer_api_seconds", "Bot API call time", ("method",))
+API_ERRORS = Counter("replyer_api_errors_total", "Failed Bot API calls", ("method", "error"))
+INGEST_QUEUE = Gauge("replyer_ingest_queue", "Update queue depth, busy workers and utilisation", ("field",))
+INGEST_UPDATES = Counter("replyer_ingest_updates_total", "Updates leaving the ingest queue by outcome", ("result",))
+LANE_WAIT_SECONDS = Histogram("replyer_lane_wait_seconds", "Time an update waited in its ingest lane", ("lane",))
+LANE_SECONDS = Histogram("replyer_lane_seconds", "Time from receipt to processed, per ingest lane", ("lane",))
+LANE_SLO = Counter("replyer_lane_slo_total", "Updates processed within or over the lane objective, or shed", ("lane", "result"))
+LOOP_LAG = Histogram("replyer_event_loop_lag_seconds", "How late the event loop wakes up",
+                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+
+# --- Instrumentation ---
+
+def timed_db(func):
+    """Decorator for async DB helpers."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, func.__name__)
+    return wrapper
+
+
+class InstrumentedMiddleware(BaseMiddleware):
+    """Wraps a middleware and records its own time, without what runs after it."""
+    def __init__(self, middleware):
+        self.middleware = middleware
+        self.name = type(middleware).__name__
+
+    async def __call__(self, handler, event, data: dict):
+        inner = 0.0
+
+        async def timed_handler(event, data):
+            nonlocal inner
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                inner += time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            return await self.middleware(timed_handler, event, data)
+        finally:
+            MIDDLEWARE_SECONDS.observe(time.perf_counter() - started - inner, self.name)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update: counts and times whole updates."""
+    async def __call__(self, handler, event, data: dict):
+        update_type = event.event_type
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATES.inc(update_type)
+            UPDATE_SECONDS.observe(time.perf_counter() - started, update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Registered last so it wraps just the handler."""
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: times every outbound Bot API call."""
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+# --- Serving ---
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+def register(app: web.Application):
+    app.router.add_get("/metrics", handle_metrics)
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Standalone /metrics server for polling mode."""
+    app = web.Application()
+    register(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
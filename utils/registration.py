@@ -0,0 +1,52 @@
+from datetime import datetime
+from cachetools import LRUCache
+from database.db import AsyncSessionLocal, add_users_bulk
+from utils.tasks import BatchWriter
+
+class RegistrationBuffer(BatchWriter):
+    """
+    Write-behind registration for /start.
+    New users are collected and inserted in one batch every `flush_interval`
+    seconds (or as soon as `max_batch` are waiting). Recently seen users are
+    remembered so returning users cost nothing. While the DB is down at most
+    `max_pending` users wait, the rest are registered on their next /start.
+    """
+    def __init__(self, flush_interval: float = 1.0, max_batch: int = 500, known_size: int = 100000,
+                 max_pending: int = 50000):
+        super().__init__(flush_interval)
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.known = LRUCache(maxsize=known_size)
+        self._pending = {}  # user_id -> row
+
+    def register(self, user_id: int, first_name: str, username: str):
+        if user_id in self.known or user_id in self._pending:
+            return
+        if len(self._pending) >= self.max_pending:
+            return
+        self._pending[user_id] = {
+            "user_id": user_id,
+            "first_name": first_name,
+            "username": username,
+            "joined_at": datetime.utcnow(),
+        }
+        if len(self._pending) >= self.max_batch:
+            self.wake()
+
+    async def flush(self):
+        while self._pending:
+            batch = dict(list(self._pending.items())[:self.max_batch])
+            for user_id in batch:
+                del self._pending[user_id]
+            try:
+                async with AsyncSessionLocal() as session:
+                    await add_users_bulk(session, list(batch.values()))
+            except Exception:
+                # Keep them for the next flush
+                for user_id, row in batch.items():
+                    self._pending.setdefault(user_id, row)
+                raise
+            for user_id in batch:
+                self.known[user_id] = True
+
+registration = RegistrationBuffer()
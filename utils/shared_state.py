@@ -0,0 +1,173 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import REDIS_URL
+from utils.cache import add_ban, remove_ban, add_bans, remove_bans, set_mute, clear_mute, BLOCKED_USERS
+from utils.stats import stats
+
+# Optional import for Redis
+try:
+    import redis.asyncio as redis
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:
+    redis = None
+
+# State shared between bot instances behind a load balancer.
+# FSM lives in Redis, ban/mute caches stay in memory and are kept coherent
+# by publishing every moderation change on a pub/sub channel.
+
+CHANNEL = "replyer:invalidate"
+
+def create_fsm_storage():
+    if REDIS_URL and redis:
+        print("✅ FSM: Using Redis")
+        return RedisStorage.from_url(REDIS_URL)
+    return MemoryStorage()
+
+
+class InvalidationBus:
+    """
+    Works with any client exposing publish() and pubsub() like redis.asyncio
+    (fakeredis is enough in tests). Without a client publish() is a no-op.
+    """
+    def __init__(self, client=None):
+        self.client = client
+        self.instance_id = uuid.uuid4().hex
+        self._pending = set()
+
+    def connect(self, client):
+        self.client = client
+
+    def publish(self, kind: str, user_id: int, value: datetime = None):
+        # Fire and forget, never blocks the handler
+        if self.client is None:
+            return
+        payload = json.dumps({
+            "from": self.instance_id,
+            "kind": kind,
+            "user_id": user_id,
+            "value": value.isoformat() if value else None,
+        })
+        task = asyncio.create_task(self._send(payload))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def publish_now(self, kind: str, user_id: int = 0) -> bool:
+        """Awaited publish for callers that must know it went out (the import CLI)."""
+        if self.client is None:
+            return False
+        return await self._send(json.dumps({
+            "from": self.instance_id,
+            "kind": kind,
+            "user_id": user_id,
+            "value": None,
+        }))
+
+    def publish_many(self, kind: str, user_ids: list, value: datetime = None):
+        """One message for a bulk change (kinds: ban, unban, mute, unmute, blocked, user)."""
+        if self.client is None or not user_ids:
+            return
+        payload = json.dumps({
+            "from": self.instance_id,
+            "kind": kind,
+            "user_ids": list(user_ids),
+            "value": value.isoformat() if value else None,
+        })
+        task = asyncio.create_task(self._send(payload))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _send(self, payload: str) -> bool:
+        try:
+            await self.client.publish(CHANNEL, payload)
+            return True
+        except Exception as e:
+            print(f"Redis Error: {e}")
+            return False
+
+    def apply(self, kind: str, user_id: int, value: datetime = None):
+        """Applies a change made by another instance to the local caches."""
+        from utils.tasks import mute_scheduler
+
+        if kind == "ban":
+            add_ban(user_id)
+        elif kind == "unban":
+            remove_ban(user_id)
+        elif kind == "mute":
+            stats.user_muted(user_id, value)
+            set_mute(user_id, value)
+            mute_scheduler.schedule(user_id, value)
+        elif kind == "unmute":
+            stats.user_unmuted(user_id)
+            clear_mute(user_id)
+            mute_scheduler.cancel(user_id)
+        elif kind == "user":
+            stats.user_added(value)
+        elif kind == "unblocked":
+            BLOCKED_USERS.discard(user_id)
+        elif kind in ("digest_on", "digest_off"):
+            from utils.digest import digests
+            digests.apply(user_id, kind == "digest_on")
+
+    def apply_many(self, kind: str, user_ids: list, value: datetime = None):
+        if kind == "ban":
+            add_bans(user_ids)
+        elif kind == "unban":
+            remove_bans(user_ids)
+        elif kind == "blocked":
+            BLOCKED_USERS.update(user_ids)
+        else:
+            for user_id in user_ids:
+                self.apply(kind, user_id, value)
+
+    async def run(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    event = json.loads(message["data"])
+                    if event["from"] == self.instance_id:
+                        continue
+                    if event["kind"] == "reload":
+                        # Bulk change (e.g. import), cheaper to reload than to describe
+                        await self.reload()
+                        continue
+                    value = datetime.fromisoformat(event["value"]) if event["value"] else None
+                    if "user_ids" in event:
+                        self.apply_many(event["kind"], event["user_ids"], value)
+                    else:
+                        self.apply(event["kind"], event["user_id"], value)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis Error: {e}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+            # Changes may have been missed while disconnected: reload from DB
+            await asyncio.sleep(5)
+            await self.reload()
+
+    async def reload(self):
+        from database.db import AsyncSessionLocal, warm_stats
+        from utils.tasks import mute_scheduler
+
+        try:
+            async with AsyncSessionLocal() as session:
+                await warm_stats(session)
+            await mute_scheduler.seed()
+        except Exception as e:
+            print(f"Error in background task: {e}")
+
+
+bus = InvalidationBus()
+if REDIS_URL and redis:
+    bus.connect(redis.from_url(REDIS_URL, decode_responses=True))
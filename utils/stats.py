@@ -0,0 +1,63 @@
+import bisect
+from datetime import datetime, timedelta
+
+from utils.cache import BANNED_USERS
+
+# Moderation counters for the admin stats panel.
+# Loaded once on startup with SQL aggregates (see database.db.warm_stats)
+# and then kept up to date by registration / ban / mute handlers and the
+# mute expiry task, so reading them never touches the DB.
+
+RECENT_WINDOW = timedelta(days=7)
+
+
+class ModerationStats:
+    def __init__(self):
+        self.total_users = 0
+        self.muted_users = {}   # user_id -> mute_until
+        self.recent_joins = []  # sorted joined_at of the last RECENT_WINDOW
+
+    def load(self, total_users: int, muted: dict, recent_joins: list):
+        self.total_users = total_users
+        self.muted_users = dict(muted)
+        self.recent_joins = sorted(recent_joins)
+
+    @property
+    def banned_count(self) -> int:
+        # BANNED_USERS is warmed with every banned id on startup
+        return len(BANNED_USERS)
+
+    @property
+    def muted_count(self) -> int:
+        # Expired entries are dropped by the mute expiry task
+        return len(self.muted_users)
+
+    def new_users_since(self, delta: timedelta) -> int:
+        self._prune()
+        since = datetime.utcnow() - delta
+        return len(self.recent_joins) - bisect.bisect_left(self.recent_joins, since)
+
+    # --- Updates ---
+
+    def user_added(self, joined_at: datetime = None):
+        self.total_users += 1
+        bisect.insort(self.recent_joins, joined_at or datetime.utcnow())
+
+    def user_muted(self, user_id: int, until: datetime):
+        self.muted_users[user_id] = until
+
+    def user_unmuted(self, user_id: int):
+        self.muted_users.pop(user_id, None)
+
+    def mutes_expired(self, user_ids):
+        for user_id in user_ids:
+            self.muted_users.pop(user_id, None)
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - RECENT_WINDOW
+        idx = bisect.bisect_left(self.recent_joins, cutoff)
+        if idx:
+            del self.recent_joins[:idx]
+
+
+stats = ModerationStats()
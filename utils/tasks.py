@@ -1,36 +1,266 @@
 import asyncio
-from datetime import datetime
-from sqlalchemy import select
-from database.db import AsyncSessionLocal, User
-from utils.cache import remove_ban
+import heapq
+import logging
+import math
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from config import ROUTE_RETENTION_DAYS
+from database.db import AsyncSessionLocal, User, prune_message_routes
+from utils.cache import remove_ban, clear_mute
+from utils.stats import stats
 
-async def check_expired_mutes():
+class MuteExpiryScheduler:
+    """
+    Clears expired mutes exactly when they expire.
+    Deadlines live in a min-heap; the task sleeps until the earliest one
+    (or until an earlier mute is scheduled) instead of polling the table.
+    """
+    def __init__(self):
+        self._heap = []  # (mute_until, user_id)
+        self._deadlines = {}  # user_id -> current mute_until, stale heap entries are skipped
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, user_id: int, until: datetime):
+        self._deadlines[user_id] = until
+        heapq.heappush(self._heap, (until, user_id))
+        if self._heap[0] == (until, user_id):
+            self._wakeup.set()
+
+    def cancel(self, user_id: int):
+        self._deadlines.pop(user_id, None)
+
+    async def seed(self):
+        # Past deadlines are included so mutes that expired while we were down are cleared at once
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(User.user_id, User.mute_until).where(User.mute_until.is_not(None))
+            )
+            for user_id, until in result.all():
+                self.schedule(user_id, until)
+
+    def _pop_due(self, now: datetime) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            until, user_id = heapq.heappop(self._heap)
+            if self._deadlines.get(user_id) == until:
+                del self._deadlines[user_id]
+                due.append((until, user_id))
+        return due
+
+    async def _expire(self, now: datetime, due_ids: list):
+        # One bulk UPDATE for everything that is due
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(User)
+                .where(User.mute_until <= now)
+                .values(mute_until=None)
+                .returning(User.user_id)
+                .execution_options(synchronize_session=False)
+            )
+            user_ids = result.scalars().all()
+            await session.commit()
+
+        # With several instances only one of them wins the UPDATE, the others
+        # have the same deadlines and clear their local state from them
+        user_ids = set(user_ids) | set(due_ids)
+        stats.mutes_expired(user_ids)
+        for user_id in user_ids:
+            clear_mute(user_id)
+
+    async def run(self):
+        while True:
+            try:
+                await self.seed()
+                break
+            except Exception:
+                logging.exception("Mute expiry: loading mutes failed, retrying")
+                await asyncio.sleep(5)
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            due = self._pop_due(now)
+            if due:
+                try:
+                    await self._expire(now, [user_id for _, user_id in due])
+                except Exception:
+                    logging.exception("Mute expiry failed")
+                    for until, user_id in due:
+                        self.schedule(user_id, until)
+                    await asyncio.sleep(5)
+                continue
+
+            timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+mute_scheduler = MuteExpiryScheduler()
+
+class DelayedActions:
+    """
+    Runs "do X at time T" jobs (e.g. delete a confirmation) off the update path.
+    Deadlines are rounded up to `resolution` so nearby jobs share one wakeup.
+    A job scheduled with a key replaces the pending job with the same key
+    (keeping the first deadline), so a burst of updates ends in one call.
+    """
+    def __init__(self, resolution: float = 0.5, max_pending: int = 10000):
+        self.resolution = resolution
+        self.max_pending = max_pending
+        self._buckets = {}  # rounded deadline -> [job, ...]
+        self._heap = []  # rounded deadlines
+        self._keyed = {}  # key -> latest job
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, delay: float, job, key=None) -> bool:
+        """
+        job: zero-argument callable returning an awaitable.
+        Returns False if the queue is full and the job was dropped.
+        """
+        if key is not None and key in self._keyed:
+            self._keyed[key] = job
+            return True
+        if self._pending >= self.max_pending:
+            return False
+        if key is not None:
+            self._keyed[key] = job
+            job = lambda: self._keyed.pop(key)()
+        loop = asyncio.get_running_loop()
+        deadline = math.ceil((loop.time() + delay) / self.resolution) * self.resolution
+        bucket = self._buckets.get(deadline)
+        if bucket is None:
+            bucket = self._buckets[deadline] = []
+            heapq.heappush(self._heap, deadline)
+            if self._heap[0] == deadline:
+                self._wakeup.set()
+        bucket.append(job)
+        self._pending += 1
+        return True
+
+    async def _run_jobs(self, jobs: list):
+        self._pending -= len(jobs)
+        # Failures are ignored, typically the message is already gone
+        await asyncio.gather(*(self._call(job) for job in jobs), return_exceptions=True)
+
+    @staticmethod
+    async def _call(job):
+        # Bot API methods (sent_msg.delete) are awaitable but not coroutines,
+        # gather() cannot take them directly
+        return await job()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            due = []
+            while self._heap and self._heap[0] <= now:
+                due.extend(self._buckets.pop(heapq.heappop(self._heap)))
+            if due:
+                await self._run_jobs(due)
+                continue
+
+            timeout = self._heap[0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def flush(self):
+        """Runs every pending job now (on shutdown)."""
+        jobs = [job for bucket in self._buckets.values() for job in bucket]
+        self._buckets.clear()
+        self._heap.clear()
+        if jobs:
+            await self._run_jobs(jobs)
+
+delayed_actions = DelayedActions()
+
+class BatchWriter:
     """
-    Periodically checks for expired mutes and updates DB.
-    Also ensures bans are synced if needed (though bans are infinite usually).
+    Base for write-behind buffers: handlers only append in memory, run()
+    calls flush() every `flush_interval` seconds or as soon as wake() is called.
+    stop() ends the loop after the flush in progress and flushes what is
+    left, so shutdown never cancels a batch halfway.
     """
-    while True:
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self.stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def timeout(self):
+        """Seconds until the next flush, None to wait for wake()."""
+        return self.flush_interval
+
+    async def flush(self):
+        raise NotImplementedError
+
+    async def run(self):
+        self._task = asyncio.current_task()
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception(f"{type(self).__name__}: flush failed")
+
+    async def stop(self):
+        self.stopping = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
         try:
+            await self.flush()
+        except Exception:
+            logging.exception(f"{type(self).__name__}: final flush failed")
+
+class Retention:
+    """
+    Deletes rows older than `days` every `interval` seconds.
+    prune_chunk(session, before) deletes one chunk and returns how many rows
+    it deleted: chunks are small transactions, writers are never blocked for long.
+    """
+    def __init__(self, name: str, prune_chunk, days: int, interval: float = 3600):
+        self.name = name
+        self.prune_chunk = prune_chunk
+        self.retention = timedelta(days=days)
+        self.interval = interval
+
+    async def prune(self) -> int:
+        before = datetime.utcnow() - self.retention
+        deleted = 0
+        while True:
             async with AsyncSessionLocal() as session:
-                now = datetime.utcnow()
-                # Find users who are muted AND mute time has passed
-                # Actually, our logic in handlers just checks `mute_until > now`. 
-                # If `mute_until` is in past, they are effectively unmuted.
-                # BUT user requested: "Remove mute flag if time expired".
-                # So we set mute_until = None for clean DB.
-                
-                stmt = select(User).where(User.mute_until < now)
-                result = await session.execute(stmt)
-                users = result.scalars().all()
-                
-                for user in users:
-                    user.mute_until = None
-                
-                if users:
-                    await session.commit()
-                    # print(f"Cleaned up {len(users)} expired mutes.")
-                    
-        except Exception as e:
-            print(f"Error in background task: {e}")
-            
-        await asyncio.sleep(60) # Check every minute
+                count = await self.prune_chunk(session, before)
+            deleted += count
+            if count == 0:
+                return deleted
+            await asyncio.sleep(0.1)
+
+    async def run(self):
+        while True:
+            try:
+                deleted = await self.prune()
+                if deleted:
+                    print(f"✅ {self.name}: deleted {deleted} rows older than {self.retention.days} days")
+            except Exception:
+                logging.exception(f"{self.name} retention failed")
+            await asyncio.sleep(self.interval)
+
+route_retention = Retention("Reply routes", prune_message_routes, ROUTE_RETENTION_DAYS)
+
+async def check_expired_mutes():
+    """
+    Runs the mute expiry scheduler.
+    Mutes are removed from DB (mute_until = None) as soon as they expire.
+    """
+    await mute_scheduler.run()